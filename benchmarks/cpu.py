@@ -0,0 +1,123 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Measure the CPU time the client spends per GB downloaded, reading bodies
+with iter_content and into reused buffers, writing the results as JSON. The
+mock API runs in a separate process so only the client is measured::
+
+    python benchmarks/cpu.py --gigabytes 2 --output cpu.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from planet import api
+from planet.api import models
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _server(size):
+    process = subprocess.Popen(
+        [sys.executable, '-u', os.path.join(_here, 'server.py'),
+         '--port', '0', '--file-size', str(size)], stdout=subprocess.PIPE)
+    line = process.stdout.readline().decode('utf-8')
+    return process, line.split()[-1]
+
+
+def _cpu():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _measure(url, opts, size, fast):
+    models.fast_write = fast
+    scenes = max(1, int(opts.gigabytes * 1024 ** 3 // size))
+    directory = tempfile.mkdtemp(prefix='planet-bench-')
+    try:
+        client = api.Client('bench', url, workers=opts.workers)
+        ids = ['scene-%06d' % (i % 100) for i in range(scenes)]
+        start, cpu = time.time(), _cpu()
+        transferred = 0
+        for download in client.download_scene_geotiffs(ids, directory):
+            if download.error:
+                raise download.error
+            transferred += download.bytes
+        cpu, elapsed = _cpu() - cpu, time.time() - start
+    finally:
+        shutil.rmtree(directory)
+    gigabytes = transferred / float(1024 ** 3)
+    return {
+        'name': 'fast_write' if fast else 'iter_content',
+        'params': {'size': size, 'workers': opts.workers},
+        'bytes': transferred,
+        'seconds': elapsed,
+        'cpu_seconds': cpu,
+        'cpu_seconds_per_gb': cpu / gigabytes,
+        'mb_per_second': transferred / (1024. * 1024) / elapsed
+    }
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gigabytes', type=float, default=1,
+                        help='downloaded by each run')
+    parser.add_argument('--sizes', type=_ints, default=[64 * 1024 * 1024])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help='file to write, stdout by default')
+    opts = parser.parse_args(argv)
+
+    results = []
+    for size in opts.sizes:
+        process, url = _server(size)
+        try:
+            for fast in (False, True):
+                result = _measure(url, opts, size, fast)
+                sys.stderr.write('%s %s %.2f cpu seconds per GB\n' % (
+                    result['name'], json.dumps(result['params'],
+                                               sort_keys=True),
+                    result['cpu_seconds_per_gb']))
+                results.append(result)
+        finally:
+            process.terminate()
+            process.wait()
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'options': {'gigabytes': opts.gigabytes},
+        'results': results
+    }
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
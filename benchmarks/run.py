@@ -0,0 +1,265 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Run the client against a local mock API across worker counts and payload
+sizes, writing the results as JSON. For example::
+
+    python benchmarks/run.py --workers 1,4,16 --sizes 65536,4194304 \\
+        --output results.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from click.testing import CliRunner
+
+import planet
+from planet import api
+from planet import scripts
+from planet.api.utils import write_to_file
+
+from server import MockAPI
+
+benchmarks = {}
+
+
+def benchmark(func):
+    benchmarks[func.__name__] = func
+    return func
+
+
+def _result(name, server, elapsed, bytes=0, **params):
+    return {
+        'name': name,
+        'params': params,
+        'seconds': elapsed,
+        'bytes': bytes,
+        'mb_per_second': bytes / (1024. * 1024) / elapsed,
+        'requests': server.requests,
+        'requests_per_second': server.requests / elapsed,
+        'throttled': server.throttled
+    }
+
+
+def _ids(count):
+    return ['scene-%06d' % i for i in range(count)]
+
+
+def _cli(server, workers, *args):
+    result = CliRunner().invoke(scripts.cli, [
+        '-u', server.url, '-k', 'bench', '-w', str(workers)
+    ] + list(args))
+    if result.exit_code != 0:
+        raise Exception(result.output)
+
+
+class _tempdir(object):
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='planet-bench-')
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+@benchmark
+def fetch_scene_geotiffs(opts, workers, size):
+    with MockAPI(file_size=size, latency=opts.latency,
+                 bandwidth=opts.bandwidth) as server, _tempdir() as directory:
+        client = api.Client('bench', server.url, workers=workers)
+        start = time.time()
+        responses = client.fetch_scene_geotiffs(
+            _ids(opts.scenes), callback=write_to_file(directory))
+        for response in responses:
+            response.await()
+        elapsed = time.time() - start
+    return _result('fetch_scene_geotiffs', server, elapsed,
+                   size * opts.scenes, workers=workers, size=size,
+                   scenes=opts.scenes)
+
+
+@benchmark
+def download_scene_geotiffs(opts, workers, size):
+    with MockAPI(file_size=size, latency=opts.latency,
+                 bandwidth=opts.bandwidth) as server, _tempdir() as directory:
+        client = api.Client('bench', server.url, workers=workers)
+        start = time.time()
+        transferred = sum(d.bytes for d in client.download_scene_geotiffs(
+            _ids(opts.scenes), directory))
+        elapsed = time.time() - start
+    return _result('download_scene_geotiffs', server, elapsed, transferred,
+                   workers=workers, size=size, scenes=opts.scenes)
+
+
+@benchmark
+def throttled_downloads(opts, workers, size):
+    '''downloads with a fifth of requests refused, fixed and adaptive'''
+    results = []
+    for adaptive in (False, True):
+        with MockAPI(file_size=size, latency=opts.latency,
+                     bandwidth=opts.bandwidth, throttle=.2) as server, \
+                _tempdir() as directory:
+            limit = api.ConcurrencyLimit(1, workers) if adaptive else None
+            client = api.Client('bench', server.url, workers=workers,
+                                limit=limit)
+            start = time.time()
+            transferred = sum(d.bytes for d in client.download_scene_geotiffs(
+                _ids(opts.scenes), directory))
+            elapsed = time.time() - start
+        results.append(_result('throttled_downloads', server, elapsed,
+                               transferred, workers=workers, size=size,
+                               scenes=opts.scenes, adaptive=adaptive))
+    return results
+
+
+@benchmark
+def scenes_iter(opts, workers, size):
+    '''paging through a search, with and without prefetching'''
+    results = []
+    for prefetch in (0, 2):
+        with MockAPI(scenes=opts.scenes * 20, page_size=opts.page_size,
+                     latency=opts.latency) as server:
+            client = api.Client('bench', server.url, workers=workers)
+            start = time.time()
+            scenes = client.get_scenes_list(count=opts.page_size)
+            found = sum(len(page.get()['features'])
+                        for page in scenes.iter(prefetch=prefetch))
+            elapsed = time.time() - start
+        results.append(_result('scenes_iter', server, elapsed,
+                               workers=workers, page_size=opts.page_size,
+                               scenes=found, prefetch=prefetch))
+    return results
+
+
+@benchmark
+def burst_metadata(opts, workers, size):
+    '''threads asking for the same few scenes at once, with and without
+    coalescing identical requests'''
+    results = []
+    for coalesce in (None, 'json'):
+        with MockAPI(latency=opts.latency) as server:
+            client = api.Client('bench', server.url, workers=workers,
+                                coalesce=coalesce)
+
+            def fetch():
+                for sid in _ids(4):
+                    client.get_scene_metadata(sid).get()
+            threads = [threading.Thread(target=fetch)
+                       for _ in range(opts.scenes)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+        results.append(_result('burst_metadata', server, elapsed,
+                               workers=workers, threads=opts.scenes,
+                               coalesce=coalesce))
+    return results
+
+
+@benchmark
+def cli_download(opts, workers, size):
+    with MockAPI(file_size=size, latency=opts.latency,
+                 bandwidth=opts.bandwidth) as server, _tempdir() as directory:
+        start = time.time()
+        _cli(server, workers, 'download', '-d', directory,
+             *_ids(opts.scenes))
+        elapsed = time.time() - start
+    return _result('cli_download', server, elapsed, size * opts.scenes,
+                   workers=workers, size=size, scenes=opts.scenes)
+
+
+@benchmark
+def cli_sync(opts, workers, size):
+    with MockAPI(scenes=opts.scenes, page_size=opts.page_size,
+                 file_size=size, latency=opts.latency,
+                 bandwidth=opts.bandwidth) as server, _tempdir() as directory:
+        with open(os.path.join(directory, 'aoi.geojson'), 'w') as fp:
+            fp.write('{}')
+        start = time.time()
+        _cli(server, workers, 'sync', directory)
+        elapsed = time.time() - start
+    return _result('cli_sync', server, elapsed, size * opts.scenes,
+                   workers=workers, size=size, scenes=opts.scenes,
+                   page_size=opts.page_size)
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', type=lambda v: v.split(','),
+                        default=sorted(benchmarks),
+                        help='comma separated benchmarks to run, of %s' %
+                        ', '.join(sorted(benchmarks)))
+    parser.add_argument('--workers', type=_ints, default=[1, 4, 16])
+    parser.add_argument('--sizes', type=_ints, default=[64 * 1024,
+                                                        4 * 1024 * 1024])
+    parser.add_argument('--scenes', type=int, default=32,
+                        help='scenes downloaded in each run')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=.01,
+                        help='seconds before each response')
+    parser.add_argument('--bandwidth', type=int, default=None,
+                        help='bytes per second of each response')
+    parser.add_argument('--output', help='file to write, stdout by default')
+    opts = parser.parse_args(argv)
+
+    results = []
+    for name in opts.only:
+        for workers in opts.workers:
+            sizes = [None] if name in ('scenes_iter', 'burst_metadata') \
+                else opts.sizes
+            for size in sizes:
+                result = benchmarks[name](opts, workers, size)
+                for r in result if isinstance(result, list) else [result]:
+                    sys.stderr.write('%s %s %.3fs\n' % (
+                        r['name'], json.dumps(r['params'], sort_keys=True),
+                        r['seconds']))
+                    results.append(r)
+    report = {
+        'planet': planet.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'options': {
+            'scenes': opts.scenes,
+            'page_size': opts.page_size,
+            'latency': opts.latency,
+            'bandwidth': opts.bandwidth
+        },
+        'results': results
+    }
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''A local HTTP server imitating the parts of the Planet API the client uses,
+with configurable latency, bandwidth, page size, rate limiting and file
+sizes. Run it on its own with `python benchmarks/server.py --help`.'''
+
+import argparse
+from datetime import datetime
+from datetime import timedelta
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+_scenes = re.compile(r'^/v0/scenes/(\w+)/?$')
+_scene = re.compile(r'^/v0/scenes/(\w+)/([\w-]+)/?$')
+_image = re.compile(r'^/v0/scenes/(\w+)/([\w-]+)/(full|thumb)/?$')
+_mosaic = re.compile(r'^/v0/mosaics/([\w-]+)/?$')
+
+_block = b'\0' * 64 * 1024
+_last_modified = 'Thu, 01 Jan 2015 00:00:00 GMT'
+
+
+class MockAPI(object):
+    '''the server and its configuration, served from a background thread
+
+    :param scenes: number of scenes in any search
+    :param page_size: the most scenes returned in one page
+    :param file_size: bytes of each full scene image
+    :param thumb_size: bytes of each thumbnail
+    :param latency: seconds to wait before each response
+    :param bandwidth: bytes per second of each response body, or None
+    :param throttle: fraction of requests answered with a 429
+    '''
+
+    def __init__(self, scenes=1000, page_size=100, file_size=1024 * 1024,
+                 thumb_size=16 * 1024, latency=0, bandwidth=None, throttle=0,
+                 seed=0, port=0):
+        self.scenes = scenes
+        self.page_size = page_size
+        self.file_size = file_size
+        self.thumb_size = thumb_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle = throttle
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.api = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/v0/' % self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        args=(.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _admit(self):
+        '''count a request, returning False if it is to be throttled'''
+        with self._lock:
+            self.requests += 1
+            if self.throttle and self._random.random() < self.throttle:
+                self.throttled += 1
+                return False
+            return True
+
+    def feature(self, index):
+        acquired = datetime(2015, 1, 1) + timedelta(minutes=index)
+        return {
+            'type': 'Feature',
+            'id': 'scene-%06d' % index,
+            'geometry': None,
+            'properties': {
+                'acquired': acquired.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+            }
+        }
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, body=True):
+        api = self.server.api
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        if api.latency:
+            time.sleep(api.latency)
+        if not api._admit():
+            return self.send(429, b'slow down', {'Retry-After': '0'}, body)
+        match = _image.match(url.path)
+        if match:
+            size = api.file_size if match.group(3) == 'full' \
+                else api.thumb_size
+            ext = 'tif' if match.group(3) == 'full' else 'png'
+            return self.send_file(match.group(2), ext, size, body)
+        match = _scene.match(url.path)
+        if match:
+            index = int(match.group(2).split('-')[-1]) \
+                if match.group(2).startswith('scene-') else 0
+            return self.send_json(api.feature(index), body)
+        match = _scenes.match(url.path)
+        if match:
+            return self.send_page(url.path, query, body)
+        match = _mosaic.match(url.path)
+        if match:
+            return self.send_json({'name': match.group(1)}, body)
+        if url.path.rstrip('/') == '/v0/mosaics':
+            return self.send_json({'mosaics': [{'name': 'mosaic'}]}, body)
+        self.send(404, b'not found', body=body)
+
+    def send_page(self, path, query, body):
+        api = self.server.api
+        start = int(query.get('start', 0))
+        count = min(int(query.get('count', api.page_size)), api.page_size)
+        end = min(start + count, api.scenes)
+        links = {}
+        if end < api.scenes:
+            links['next'] = 'http://%s:%s%s?start=%s&count=%s' % (
+                self.server.server_address + (path, end, count))
+        self.send_json({
+            'type': 'FeatureCollection',
+            'count': api.scenes,
+            'links': links,
+            'features': [api.feature(i) for i in range(start, end)]
+        }, body)
+
+    def send_json(self, data, body=True):
+        self.send(200, json.dumps(data).encode('utf-8'),
+                  {'Content-Type': 'application/json'}, body)
+
+    def send(self, status, content, headers=None, body=True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def send_file(self, scene_id, ext, size, body=True):
+        start, end = 0, size - 1
+        status = 200
+        headers = {
+            'Content-Disposition': 'attachment; filename="%s.%s"' % (
+                scene_id, ext),
+            'Last-Modified': _last_modified,
+            'Accept-Ranges': 'bytes'
+        }
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            status = 206
+            headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if body:
+            self.stream(end - start + 1)
+
+    def stream(self, remaining):
+        bandwidth = self.server.api.bandwidth
+        while remaining > 0:
+            chunk = _block[:remaining]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+            if bandwidth:
+                time.sleep(float(len(chunk)) / bandwidth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--scenes', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--file-size', type=int, default=1024 * 1024)
+    parser.add_argument('--thumb-size', type=int, default=16 * 1024)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--bandwidth', type=int, default=None)
+    parser.add_argument('--throttle', type=float, default=0)
+    args = parser.parse_args()
+    api = MockAPI(args.scenes, args.page_size, args.file_size,
+                  args.thumb_size, args.latency, args.bandwidth,
+                  args.throttle, port=args.port)
+    print('serving %s' % api.url)
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
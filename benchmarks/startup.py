@@ -0,0 +1,140 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Time the start of the CLI in fresh interpreters, writing the results as
+JSON. Where the interpreter supports `-X importtime` (python 3.7 and later)
+the slowest imports are reported as well. Exits with an error if a command
+that makes no request imports any of the transport modules::
+
+    python benchmarks/startup.py --runs 20 --output startup.json
+'''
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+# commands run in a fresh interpreter, none of which make a request
+commands = {
+    'import': 'import planet.scripts',
+    'version': 'from planet.scripts import cli; cli(["--version"])',
+    'help': 'from planet.scripts import cli; cli(["help"])',
+}
+
+# modules only needed once a request is made
+transport = ('requests', 'requests_futures', 'concurrent.futures', 'sqlite3',
+             'planet.api.client', 'planet.api.dispatch')
+
+_check = '''
+import atexit, sys
+def check():
+    loaded = [m for m in %r if m in sys.modules]
+    sys.stderr.write('loaded: %%s\\n' %% ','.join(loaded))
+atexit.register(check)
+'''
+
+
+def _run(code, importtime=False):
+    args = [sys.executable]
+    if importtime:
+        args += ['-X', 'importtime']
+    args += ['-c', (_check % (transport,)) + code]
+    start = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    elapsed = time.time() - start
+    if process.returncode:
+        raise Exception(err.decode('utf-8', 'replace'))
+    return elapsed, err.decode('utf-8', 'replace').splitlines()
+
+
+def _loaded(lines):
+    for line in lines:
+        if line.startswith('loaded: '):
+            return [m for m in line[len('loaded: '):].split(',') if m]
+    return []
+
+
+def _importtime(lines, top):
+    '''the imports taking longest, cumulative microseconds by module'''
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+    return [{'module': module, 'cumulative_us': us}
+            for us, module in sorted(imports, reverse=True)[:top]]
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10,
+                        help='interpreters started for each command')
+    parser.add_argument('--top', type=int, default=15,
+                        help='slowest imports reported for each command')
+    parser.add_argument('--output', help='file to write, stdout by default')
+    opts = parser.parse_args(argv)
+
+    importtime = sys.version_info >= (3, 7)
+    results = []
+    failed = False
+    for name in sorted(commands):
+        times = []
+        for _ in range(opts.runs):
+            elapsed, lines = _run(commands[name])
+            times.append(elapsed)
+        result = {
+            'name': name,
+            'runs': opts.runs,
+            'median_seconds': _median(times),
+            'min_seconds': min(times),
+            'transport_loaded': _loaded(lines)
+        }
+        if importtime:
+            _, lines = _run(commands[name], importtime=True)
+            result['imports'] = _importtime(lines, opts.top)
+        if result['transport_loaded']:
+            failed = True
+        sys.stderr.write('%s %.3fs %s\n' % (
+            name, result['median_seconds'],
+            ','.join(result['transport_loaded']) or 'no transport'))
+        results.append(result)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results
+    }
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    if failed:
+        sys.exit('transport modules imported without making a request')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,12 +12,60 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
+import sys
+import types
+
 from .exceptions import (APIException, BadQuery, InvalidAPIKey)
 from .exceptions import (NoPermission, MissingResource, OverQuota)
-from .exceptions import (ServerError,)
-from .client import Client
+from .exceptions import (ServerError, ChecksumMismatch)
+from . import auth  # noqa
+from . import exceptions  # noqa
+
+# the names below are imported on first use, so that importing the package
+# (for the exceptions, or by the CLI for `planet help`) doesn't import
+# requests and the rest of the transport
+_lazy = {
+    'Client': 'client',
+    'DiskCache': 'cache',
+    'ThumbnailCache': 'cache',
+    'RetryPolicy': 'retry',
+    'ConcurrencyLimit': 'concurrency',
+    'EventLog': 'metrics',
+    'Metrics': 'metrics',
+    'WriterPool': 'writer',
+}
+_submodules = ('aio', 'cache', 'catalog', 'checksum', 'client', 'concurrency',
+               'dispatch', 'metrics', 'models', 'retry', 'utils', 'writer')
 
 __all__ = [
-    Client, APIException, BadQuery, InvalidAPIKey,
-    NoPermission, MissingResource, OverQuota, ServerError
+    'Client', 'DiskCache', 'ThumbnailCache', 'RetryPolicy',
+    'ConcurrencyLimit', 'EventLog', 'Metrics', 'WriterPool', 'APIException',
+    'BadQuery', 'InvalidAPIKey', 'NoPermission', 'MissingResource',
+    'OverQuota', 'ServerError', 'ChecksumMismatch'
 ]
+
+
+class _Package(types.ModuleType):
+    '''this package, importing the lazy names and submodules when first
+    accessed'''
+
+    def __getattr__(self, name):
+        if name in _lazy:
+            module = importlib.import_module('.' + _lazy[name], __name__)
+        elif name in _submodules:
+            module = importlib.import_module('.' + name, __name__)
+            return module
+        else:
+            raise AttributeError("module '%s' has no attribute '%s'" % (
+                __name__, name))
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+
+_package = _Package(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# python 2 clears the globals of a module once it is no longer referenced
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
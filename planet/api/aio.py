@@ -0,0 +1,258 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''asyncio based client mirroring `planet.api.Client`. Requires Python 3.4+
+and the optional `aiohttp` dependency (`pip install planet[async]`).
+
+All client methods are coroutines::
+
+    client = AsyncClient()
+    scenes = loop.run_until_complete(client.get_scenes_list(count=100))
+'''
+
+import asyncio
+import json
+import os
+
+import aiohttp
+
+from . import auth
+from . import models
+from .exceptions import InvalidAPIKey
+from .utils import get_filename
+from .utils import status_exception
+
+
+class Body(object):
+
+    def __init__(self, http_response, client):
+        self.response = http_response
+        self._client = client
+        self.size = int(self.response.headers.get('content-length', 0))
+        self.name = get_filename(self.response)
+
+    def __len__(self):
+        return self.size
+
+    last_modified = models.Body.last_modified
+    _unchanged = models.Body._unchanged
+
+    @asyncio.coroutine
+    def get_raw(self):
+        text = yield from self.response.text(encoding='utf-8')
+        return text
+
+    @asyncio.coroutine
+    def _write(self, fp, callback):
+        total = 0
+        while True:
+            chunk = yield from self.response.content.read(models.chunk_size)
+            if not chunk:
+                break
+            fp.write(chunk)
+            total += len(chunk)
+            if callback:
+                callback(len(chunk))
+        self.response.release()
+        # seems some responses don't have a content-length header
+        if self.size == 0:
+            self.size = total
+        if callback:
+            callback(self)
+
+    @asyncio.coroutine
+    def write(self, file=None, callback=None, skip_unchanged=False):
+        '''write the body to the provided file object or path. when writing
+        to a path, content goes to a partial file that is only moved into
+        place once complete. see `planet.api.models.Body.write` for
+        `skip_unchanged`.'''
+        if not file:
+            file = self.name
+        if not file:
+            raise ValueError('no file name provided or discovered in response')
+        if hasattr(file, 'write'):
+            yield from self._write(file, callback)
+            return
+        if skip_unchanged and self._unchanged(file):
+            self.response.close()
+            if callback:
+                callback(self)
+            return
+        partial = file + models.partial_suffix
+        with open(partial, 'wb') as fp:
+            yield from self._write(fp, callback)
+        if os.path.exists(file):
+            os.remove(file)
+        os.rename(partial, file)
+
+
+class JSON(Body):
+
+    @asyncio.coroutine
+    def get(self):
+        raw = yield from self.get_raw()
+        return json.loads(raw)
+
+
+class Scenes(JSON):
+
+    @asyncio.coroutine
+    def next(self):
+        links = (yield from self.get())['links']
+        next = links.get('next', None)
+        if next:
+            page = yield from self._client._get(next, Scenes)
+            return page
+
+    def iter(self, pages=None):
+        '''an asynchronous iterator over this and subsequent pages. With
+        Python 3.5+ use `async for page in scenes.iter()`, otherwise call
+        `yield from pages.next()` until it returns None.'''
+        return ScenePages(self, pages)
+
+
+class ScenePages(object):
+
+    def __init__(self, first, pages=None):
+        self._page = None
+        self._first = first
+        self._remaining = int(10e10) if pages is None else pages
+
+    @asyncio.coroutine
+    def next(self):
+        if self._remaining <= 0:
+            return None
+        if self._page is None:
+            self._page = self._first
+        else:
+            self._page = yield from self._page.next()
+        self._remaining -= 1
+        return self._page
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        page = yield from self.next()
+        if page is None:
+            raise StopAsyncIteration
+        return page
+
+
+class Image(Body):
+    pass
+
+
+def write_to_file(directory=None, callback=None, skip_unchanged=False):
+    @asyncio.coroutine
+    def writer(body):
+        file = os.path.join(directory, body.name) if directory else None
+        yield from body.write(file, callback, skip_unchanged)
+    return writer
+
+
+class AsyncClient(object):
+    '''Client using coroutines in place of a worker pool. `limit` bounds the
+    number of requests in flight at once.'''
+
+    def __init__(self, api_key=None, base_url='https://api.planet.com/v0/',
+                 limit=100, loop=None):
+        api_key = api_key or auth.find_api_key()
+        self.auth = api_key and auth.APIKey(api_key)
+        self.base_url = base_url
+        self.loop = loop or asyncio.get_event_loop()
+        connector = aiohttp.TCPConnector(limit=limit, loop=self.loop)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             loop=self.loop)
+
+    @asyncio.coroutine
+    def close(self):
+        yield from self.session.close()
+
+    @asyncio.coroutine
+    def _get(self, path, body_type=JSON, params=None):
+        if not self.auth:
+            raise InvalidAPIKey('No API key provided')
+        if path.startswith('http'):
+            url = path
+        else:
+            url = self.base_url + path
+        params = dict((k, v) for k, v in (params or {}).items()
+                      if v is not None)
+        headers = {'Authorization': 'api-key %s' % self.auth.value}
+        response = yield from self.session.get(url, params=params,
+                                               headers=headers)
+        if response.status not in (200, 206):
+            text = yield from response.text()
+            raise status_exception(response.status, text)
+        return body_type(response, self)
+
+    @asyncio.coroutine
+    def _download(self, path, params, callback):
+        body = yield from self._get(path, Image, params)
+        if callback:
+            yield from callback(body)
+        return body
+
+    def _download_many(self, paths, params, callback):
+        return asyncio.gather(*[self._download(path, params, callback)
+                                for path in paths], loop=self.loop)
+
+    @asyncio.coroutine
+    def get_scenes_list(self, scene_type='ortho', order_by=None, count=None,
+                        intersects=None, **filters):
+        params = {
+            'order_by': order_by,
+            'count': count,
+            'intersects': intersects
+        }
+        params.update(**filters)
+        scenes = yield from self._get('scenes/%s' % scene_type, Scenes,
+                                      params=params)
+        return scenes
+
+    @asyncio.coroutine
+    def get_scene_metadata(self, scene_id, scene_type='ortho'):
+        body = yield from self._get('scenes/%s/%s' % (scene_type, scene_id))
+        return body
+
+    def fetch_scene_geotiffs(self, scene_ids, scene_type='ortho',
+                             product='visual', callback=None):
+        '''fetch full scene images concurrently. `callback` is a coroutine
+        function given each body, see `write_to_file`.'''
+        params = {
+            'product': product
+        }
+        paths = ['scenes/%s/%s/full' % (scene_type, sid) for sid in scene_ids]
+        return self._download_many(paths, params, callback)
+
+    def fetch_scene_thumbnails(self, scene_ids, scene_type='ortho', size='md',
+                               fmt='png', callback=None):
+        params = {
+            'size': size,
+            'format': fmt
+        }
+        paths = ['scenes/%s/%s/thumb' % (scene_type, sid) for sid in scene_ids]
+        return self._download_many(paths, params, callback)
+
+    @asyncio.coroutine
+    def list_mosaics(self):
+        body = yield from self._get('mosaics')
+        return body
+
+    @asyncio.coroutine
+    def get_mosaic(self, name):
+        body = yield from self._get('mosaics/%s' % name)
+        return body
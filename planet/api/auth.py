@@ -12,7 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 import os
+import threading
+import time
+
+from .utils import retry_after
 
 ENV_KEY = 'PL_API_KEY'
 
@@ -22,5 +27,74 @@ class APIKey(object):
         self.value = value
 
 
+class KeyPool(object):
+    '''Spreads requests over several API keys, each with its own quota.
+
+    :param keys: `APIKey`s or key strings
+    :param strategy: `round-robin` to take keys in turn, or `least-loaded`
+        to take the key with the fewest requests in flight
+    :param cooldown: seconds a key rests after a 429 without Retry-After,
+        while other keys are available
+    '''
+
+    def __init__(self, keys, strategy='round-robin', cooldown=60):
+        if not keys:
+            raise ValueError('no API keys provided')
+        if strategy not in ('round-robin', 'least-loaded'):
+            raise ValueError('unknown strategy %s' % strategy)
+        self.keys = [k if isinstance(k, APIKey) else APIKey(k) for k in keys]
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._order = itertools.cycle(range(len(self.keys)))
+        self._in_flight = [0] * len(self.keys)
+        self._requests = [0] * len(self.keys)
+        self._throttled = [0] * len(self.keys)
+        self._resting = [0] * len(self.keys)
+        self._lock = threading.Lock()
+
+    def _choose(self, now):
+        ready = [i for i, until in enumerate(self._resting) if until <= now]
+        if not ready:
+            # all over quota, use the one that recovers first
+            return min(range(len(self.keys)), key=self._resting.__getitem__)
+        if self.strategy == 'least-loaded':
+            return min(ready, key=self._in_flight.__getitem__)
+        for i in self._order:
+            if i in ready:
+                return i
+
+    def ready(self):
+        '''whether any key is not resting'''
+        now = time.time()
+        with self._lock:
+            return any(until <= now for until in self._resting)
+
+    def acquire(self):
+        '''the key to send a request with, to be passed to `release`'''
+        with self._lock:
+            i = self._choose(time.time())
+            self._in_flight[i] += 1
+            self._requests[i] += 1
+            return self.keys[i]
+
+    def release(self, key, response=None):
+        '''return a key, resting it if its request was refused with a 429'''
+        i = self.keys.index(key)
+        with self._lock:
+            self._in_flight[i] -= 1
+            if response is not None and response.status_code == 429:
+                self._throttled[i] += 1
+                wait = retry_after(response)
+                self._resting[i] = time.time() + (
+                    self.cooldown if wait is None else wait)
+
+    def stats(self):
+        '''requests, 429s and requests in flight of each key, in order'''
+        with self._lock:
+            return [{'requests': r, 'throttled': t, 'in_flight': f}
+                    for r, t, f in zip(self._requests, self._throttled,
+                                       self._in_flight)]
+
+
 def find_api_key():
     return os.getenv(ENV_KEY)
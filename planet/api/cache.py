@@ -0,0 +1,366 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from . import models
+from .auth import KeyPool
+from .utils import check_status
+
+# headers describing the transfer rather than the stored content
+_unstored_headers = ('content-encoding', 'content-length',
+                     'transfer-encoding', 'connection')
+
+
+class DiskCache(object):
+    '''Persistent cache of JSON responses (scene metadata, mosaics) kept in
+    `directory`. Entries younger than `ttl` seconds are served without a
+    request, older ones are revalidated with `If-None-Match` or
+    `If-Modified-Since`. Least recently used entries are evicted once the
+    stored bodies exceed `max_size` bytes.'''
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024, ttl=3600):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # key -> (use order, size), ordered by mtime for existing entries
+        self._entries = {}
+        self._clock = itertools.count()
+        stored = []
+        for name in os.listdir(directory):
+            if name.endswith('.body'):
+                stat = os.stat(os.path.join(directory, name))
+                stored.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(stored):
+            self._entries[key] = (next(self._clock), size)
+
+    @property
+    def size(self):
+        return sum(size for _, size in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'entries': len(self._entries),
+                'size': self.size
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def accepts(self, request):
+        return request.body_type is models.JSON and not request.headers
+
+    def _key(self, request):
+        params = sorted((k, v) for k, v in (request.params or {}).items()
+                        if v is not None)
+        if isinstance(request.auth, KeyPool):
+            auth = sorted(k.value for k in request.auth.keys)
+        else:
+            auth = request.auth.value if request.auth else None
+        key = json.dumps([request.url, params, auth])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def _load(self, key):
+        try:
+            with open(self._path(key, '.meta')) as fp:
+                meta = json.load(fp)
+            with open(self._path(key, '.body'), 'rb') as fp:
+                content = fp.read()
+        except (IOError, OSError, ValueError):
+            return None, None
+        return meta, content
+
+    def _store(self, key, meta, content=None):
+        with open(self._path(key, '.meta'), 'w') as fp:
+            json.dump(meta, fp)
+        if content is not None:
+            with open(self._path(key, '.body'), 'wb') as fp:
+                fp.write(content)
+        self._touch(key)
+
+    def _touch(self, key):
+        path = self._path(key, '.body')
+        try:
+            os.utime(path, None)
+            size = os.path.getsize(path)
+        except OSError:
+            # evicted in the meantime
+            return
+        with self._lock:
+            self._entries[key] = (next(self._clock), size)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = self.size
+            if total <= self.max_size:
+                return
+            lru = sorted(self._entries.items(), key=lambda e: e[1][0])
+            evicted = []
+            for key, (_, size) in lru:
+                if total <= self.max_size:
+                    break
+                del self._entries[key]
+                evicted.append(key)
+                total -= size
+        for key in evicted:
+            for ext in ('.meta', '.body'):
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+
+    def _response(self, meta, content):
+        response = Response()
+        response.status_code = 200
+        response.url = meta['url']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    def response(self, request, dispatcher):
+        '''the response for request, from the cache where possible. Any
+        request is sent from the calling thread, which may be a worker.'''
+        key = self._key(request)
+        meta, content = self._load(key)
+        if meta and time.time() - meta['stored'] < self.ttl:
+            self._count('hits')
+            self._touch(key)
+            return self._response(meta, content)
+        headers = {}
+        if meta:
+            if 'etag' in meta['headers']:
+                headers['If-None-Match'] = meta['headers']['etag']
+            if 'last-modified' in meta['headers']:
+                headers['If-Modified-Since'] = meta['headers']['last-modified']
+        conditional = models.Request(request.url, request.auth,
+                                     request.params, request.body_type,
+                                     headers=headers or None)
+        response = dispatcher._send(conditional,
+                                    dispatcher._prepare(conditional))
+        if meta and response.status_code == 304:
+            self._count('revalidated')
+            meta['stored'] = time.time()
+            meta['headers'].update(
+                (k.lower(), v) for k, v in response.headers.items()
+                if k.lower() in ('etag', 'last-modified')
+            )
+            self._store(key, meta)
+            return self._response(meta, content)
+        check_status(response)
+        self._count('misses')
+        content = response.content
+        headers = dict((k.lower(), v) for k, v in response.headers.items()
+                       if k.lower() not in _unstored_headers)
+        headers['content-length'] = str(len(content))
+        meta = {
+            'url': response.url,
+            'stored': time.time(),
+            'headers': headers
+        }
+        self._store(key, meta, content)
+        return response
+
+
+class _Load(object):
+    '''a thumbnail being loaded, which other threads asking for it wait on'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class ThumbnailCache(object):
+    '''Thumbnails held in memory as bytes, keyed by `(scene_type, id, size,
+    format)`. Least recently used ones are dropped once they exceed
+    `max_size` bytes, or if `spill` is a directory, moved there until it
+    holds more than `spill_size` bytes. Threads asking for a thumbnail
+    being loaded wait for it rather than loading it again.'''
+
+    def __init__(self, max_size=64 * 1024 * 1024, spill=None,
+                 spill_size=512 * 1024 * 1024):
+        self.max_size = max_size
+        self.spill = spill
+        self.spill_size = spill_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self.spill_hit_bytes = 0
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+        # key -> bytes and spilled file name -> size, least recent first
+        self._memory = OrderedDict()
+        self._spilled = OrderedDict()
+        self._loads = {}
+        if spill:
+            if not os.path.isdir(spill):
+                os.makedirs(spill)
+            stored = []
+            for name in os.listdir(spill):
+                stat = os.stat(os.path.join(spill, name))
+                stored.append((stat.st_mtime, name, stat.st_size))
+            for _, name, size in sorted(stored):
+                self._spilled[name] = size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'spill_hits': self.spill_hits,
+                'hit_bytes': self.hit_bytes,
+                'miss_bytes': self.miss_bytes,
+                'spill_hit_bytes': self.spill_hit_bytes,
+                'evicted_bytes': self.evicted_bytes,
+                'entries': len(self._memory),
+                'size': self.size,
+                'spill_entries': len(self._spilled),
+                'spill_size': sum(self._spilled.values())
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or self._name(key) in self._spilled
+
+    def get(self, key, load):
+        '''the bytes for key, from load() if neither in memory nor spilled'''
+        with self._lock:
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory[key] = data
+                self.hits += 1
+                self.hit_bytes += len(data)
+                return data
+            pending = self._loads.get(key)
+            loading = pending is None
+            if loading:
+                pending = self._loads[key] = _Load()
+        if not loading:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            with self._lock:
+                self.hits += 1
+                self.hit_bytes += len(pending.data)
+            return pending.data
+        try:
+            pending.data = self._load(key, load)
+            return pending.data
+        except Exception as ex:
+            pending.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._loads[key]
+            pending.done.set()
+
+    def _load(self, key, load):
+        name = self._name(key)
+        data = self._unspill(name)
+        if data is None:
+            data = load()
+            with self._lock:
+                self.misses += 1
+                self.miss_bytes += len(data)
+        else:
+            with self._lock:
+                self.spill_hits += 1
+                self.spill_hit_bytes += len(data)
+        self._put(key, name, data)
+        return data
+
+    def _name(self, key):
+        digest = hashlib.sha1(json.dumps(list(key)).encode('utf-8'))
+        return '%s.%s' % (digest.hexdigest(), key[-1])
+
+    def _unspill(self, name):
+        with self._lock:
+            if name not in self._spilled:
+                return None
+            self._spilled[name] = self._spilled.pop(name)
+        try:
+            with open(os.path.join(self.spill, name), 'rb') as fp:
+                return fp.read()
+        except (IOError, OSError):
+            with self._lock:
+                self._spilled.pop(name, None)
+            return None
+
+    def _put(self, key, name, data):
+        evicted = []
+        with self._lock:
+            if len(data) <= self.max_size:
+                self._memory[key] = data
+                self.size += len(data)
+            else:
+                self.evicted_bytes += len(data)
+                evicted.append((key, data))
+            while self.size > self.max_size:
+                lru = self._memory.popitem(last=False)
+                self.size -= len(lru[1])
+                self.evicted_bytes += len(lru[1])
+                evicted.append(lru)
+        if self.spill:
+            for key, data in evicted:
+                self._spill(self._name(key), data)
+
+    def _spill(self, name, data):
+        path = os.path.join(self.spill, name)
+        with self._lock:
+            spilled = name in self._spilled
+        if not spilled:
+            with open(path, 'wb') as fp:
+                fp.write(data)
+        removed = []
+        with self._lock:
+            self._spilled.pop(name, None)
+            self._spilled[name] = len(data)
+            total = sum(self._spilled.values())
+            while total > self.spill_size:
+                lru, size = self._spilled.popitem(last=False)
+                total -= size
+                removed.append(lru)
+        for lru in removed:
+            try:
+                os.remove(os.path.join(self.spill, lru))
+            except OSError:
+                pass
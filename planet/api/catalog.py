@@ -0,0 +1,108 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sqlite3
+import time
+
+_schema = '''
+create table if not exists scenes (
+    id text primary key,
+    acquired text,
+    metadata text,
+    status text not null default 'pending',
+    path text,
+    bytes integer,
+    checksum text,
+    added real,
+    updated real
+);
+create index if not exists scenes_status on scenes (status, acquired);
+create index if not exists scenes_acquired on scenes (acquired);
+'''
+
+
+class Catalog(object):
+    '''SQLite index of the scenes of a sync destination: their metadata and
+    download state. Writes are batched, call `commit` to persist them.'''
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_schema)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def commit(self):
+        self.db.commit()
+
+    def add(self, features):
+        '''record the features in one transaction, refreshing the metadata
+        but not the download state of scenes already present'''
+        now = time.time()
+        rows = [(f['properties']['acquired'], json.dumps(f), now, f['id'])
+                for f in features]
+        with self.db:
+            self.db.executemany(
+                'insert or ignore into scenes '
+                '(acquired, metadata, added, updated, id) '
+                'values (?, ?, ?, ?, ?)',
+                [row[:3] + (now,) + row[3:] for row in rows]
+            )
+            self.db.executemany(
+                'update scenes set acquired = ?, metadata = ?, updated = ? '
+                'where id = ?', rows
+            )
+
+    def status(self, scene_id):
+        row = self.db.execute('select status from scenes where id = ?',
+                              (scene_id,)).fetchone()
+        return row and row[0]
+
+    def metadata(self, scene_id):
+        row = self.db.execute('select metadata from scenes where id = ?',
+                              (scene_id,)).fetchone()
+        return row and json.loads(row[0])
+
+    def mark(self, scene_id, status, path=None, bytes=None, checksum=None):
+        self.db.execute(
+            'update scenes set status = ?, path = coalesce(?, path), '
+            'bytes = coalesce(?, bytes), checksum = coalesce(?, checksum), '
+            'updated = ? where id = ?',
+            (status, path, bytes, checksum, time.time(), scene_id)
+        )
+
+    def unfinished(self):
+        '''ids of scenes not yet downloaded, oldest acquired first'''
+        rows = self.db.execute(
+            'select id from scenes where status != ? order by acquired',
+            (self.DONE,)
+        )
+        return [row[0] for row in rows]
+
+    def latest(self):
+        '''the most recent acquired time of any scene recorded'''
+        row = self.db.execute('select max(acquired) from scenes').fetchone()
+        return row[0]
+
+    def counts(self):
+        return dict(self.db.execute(
+            'select status, count(*) from scenes group by status'
+        ))
@@ -0,0 +1,137 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Digests of bodies computed as they are written, and their comparison
+with digests the server sends in `Digest`, `Content-MD5` or `x-goog-hash`
+headers. crc32c requires the `crc32c` package.'''
+
+import base64
+import binascii
+import hashlib
+import struct
+
+from .exceptions import ChecksumMismatch
+
+try:
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+algorithms = ('md5', 'sha1', 'sha256', 'crc32c')
+
+# names of algorithms in digest headers
+_header_names = {
+    'md5': 'md5',
+    'sha': 'sha1',
+    'sha1': 'sha1',
+    'sha-1': 'sha1',
+    'sha-256': 'sha256',
+    'sha256': 'sha256',
+    'crc32c': 'crc32c'
+}
+
+
+class _CRC32C(object):
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = _crc32c.crc32c(data, self.value)
+
+    def digest(self):
+        return struct.pack('>I', self.value)
+
+    def hexdigest(self):
+        return '%08x' % self.value
+
+
+def _new(name):
+    if name not in algorithms:
+        raise ValueError('unsupported checksum %s, use one of %s' % (
+            name, ', '.join(algorithms)))
+    if name == 'crc32c':
+        if _crc32c is None:
+            raise ValueError('crc32c checksums require the crc32c package')
+        return _CRC32C()
+    return hashlib.new(name)
+
+
+class Digests(object):
+    '''running digests of the bytes given to `update`
+
+    :param names: algorithms, of `algorithms`
+    '''
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.reset()
+
+    def reset(self):
+        self._hashes = [_new(name) for name in self.names]
+
+    def update(self, data):
+        for digest in self._hashes:
+            digest.update(data)
+
+    def update_file(self, path, size, chunk_size=1024 * 1024):
+        '''add the first size bytes of the file at path'''
+        with open(path, 'rb') as fp:
+            while size > 0:
+                data = fp.read(min(chunk_size, size))
+                if not data:
+                    break
+                self.update(data)
+                size -= len(data)
+
+    def digests(self):
+        return dict(zip(self.names, [d.digest() for d in self._hashes]))
+
+    def hexdigests(self):
+        return dict(zip(self.names, [d.hexdigest() for d in self._hashes]))
+
+    def verify(self, headers):
+        '''raise ChecksumMismatch if a digest differs from one in headers'''
+        expected = server_digests(headers)
+        for name, digest in sorted(self.digests().items()):
+            if name in expected and expected[name] != digest:
+                raise ChecksumMismatch('%s is %s, the server sent %s' % (
+                    name, binascii.hexlify(digest).decode('ascii'),
+                    binascii.hexlify(expected[name]).decode('ascii')))
+
+
+def _decode(value):
+    try:
+        return base64.b64decode(value.strip().encode('ascii'))
+    except (TypeError, ValueError, binascii.Error):
+        return None
+
+
+def server_digests(headers):
+    '''the digests in the headers of a response, as bytes by algorithm'''
+    digests = {}
+    for header in ('digest', 'x-goog-hash'):
+        for item in headers.get(header, '').split(','):
+            name, _, value = item.partition('=')
+            name = _header_names.get(name.strip().lower())
+            if name and value:
+                digests[name] = _decode(value)
+    if 'content-md5' in headers:
+        digests['md5'] = _decode(headers['content-md5'])
+    return dict((k, v) for k, v in digests.items() if v)
+
+
+def format_checksums(checksums):
+    '''checksums by algorithm as a string, such as `sha256:01ab...`'''
+    return ' '.join('%s:%s' % item for item in sorted(checksums.items()))
@@ -12,36 +12,140 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import wait
+from requests.exceptions import RequestException
+from .cache import ThumbnailCache
 from .dispatch import RequestsDispatcher
+from .exceptions import APIException
+from .utils import check_status
 from . import auth
 from . import models
+import os
+import time
+
+
+def _read_body(dispatcher):
+    '''a callback checking the status of a response and reading its body'''
+    def read(session, response):
+        check_status(response)
+        dispatcher._read(response)
+    return read
+
+
+def _bounded(items, submit, window, ordered=False):
+    '''submit items with no more than window futures pending, yielding
+    (item, future) as each completes or, if ordered, in order of items'''
+    items = iter(items)
+    pending = deque()
+    submitted = {}
+
+    def fill():
+        for item in items:
+            future = submit(item)
+            submitted[future] = item
+            pending.append(future)
+            if len(pending) >= window:
+                break
+
+    fill()
+    while pending:
+        if ordered:
+            done = [pending.popleft()]
+            wait(done)
+        else:
+            done = wait(pending, return_when=FIRST_COMPLETED).done
+            for future in done:
+                pending.remove(future)
+        for future in done:
+            yield submitted.pop(future), future
+        fill()
 
 
 class Client(object):
+    """
+    :param api_key:
+        The API key, or a list of keys to spread requests over, or a
+        `planet.api.auth.KeyPool` to choose how they are spread. By default
+        the key in the `PL_API_KEY` environment variable.
+    :param cache:
+        Optional `planet.api.cache.DiskCache` for JSON responses such as
+        scene and mosaic metadata.
+    :param retry:
+        `planet.api.retry.RetryPolicy` for failed requests, a default one is
+        used if not provided. Use `RetryPolicy(retries=0)` to disable.
+    :param limit:
+        Optional `planet.api.concurrency.ConcurrencyLimit` to adapt the
+        number of requests in flight between a floor and ceiling in place of
+        a fixed number of `workers`.
+    :param hooks:
+        Callables given an event for each request attempt and body written,
+        such as `planet.api.metrics.Metrics` or `EventLog`.
+    :param writer:
+        Optional `planet.api.writer.WriterPool` to write downloads to disk
+        from threads of its own, with a bounded buffer between them and the
+        workers reading responses.
+    :param coalesce:
+        Which identical requests made at once, from several threads, share
+        one request and response: `json` (the default) for metadata and
+        searches, `all` to include images, or None.
+    :param dispatcher:
+        The `dispatcher` of another client to share its workers and
+        connections, in which case `workers`, `cache`, `retry`, `limit`,
+        `hooks`, `writer` and `coalesce` are those it was created with.
+    :param thumbnails:
+        The `planet.api.cache.ThumbnailCache` holding thumbnails fetched by
+        `get_scene_thumbnail`, a default one is used if not provided.
+    """
 
     def __init__(self, api_key=None, base_url='https://api.planet.com/v0/',
-                 workers=4):
+                 workers=4, segments=1, cache=None, retry=None, limit=None,
+                 hooks=None, writer=None, coalesce='json', dispatcher=None,
+                 thumbnails=None):
         api_key = api_key or auth.find_api_key()
-        self.auth = api_key and auth.APIKey(api_key)
+        if isinstance(api_key, (list, tuple)):
+            api_key = auth.KeyPool(api_key)
+        if isinstance(api_key, (auth.APIKey, auth.KeyPool)):
+            self.auth = api_key
+        else:
+            self.auth = api_key and auth.APIKey(api_key)
         self.base_url = base_url
-        self.dispatcher = RequestsDispatcher(workers)
+        self.dispatcher = dispatcher or RequestsDispatcher(
+            workers, cache, retry, limit, hooks, writer, coalesce)
+        self.segments = segments
+        self.thumbnails = thumbnails or ThumbnailCache()
 
-    def _request(self, path, body_type=models.JSON, params=None):
+    def warm(self, connections=None):
+        """
+        Open connections to the API ahead of a batch of requests so they do
+        not all pay for a TLS handshake at once.
+
+        :param connections:
+            How many, by default one for each worker.
+        """
+        return self.dispatcher.warm(self.base_url, connections)
+
+    def _request(self, path, body_type=models.JSON, params=None, segments=1):
         if path.startswith('http'):
             url = path
         else:
             url = self.base_url + path
-        return models.Request(url, self.auth, params, body_type)
+        return models.Request(url, self.auth, params, body_type,
+                              segments=segments)
 
-    def _get(self, path, body_type=models.JSON, params=None, callback=None):
-        request = self._request(path, body_type, params)
+    def _get(self, path, body_type=models.JSON, params=None, callback=None,
+             segments=1):
+        request = self._request(path, body_type, params, segments)
         response = self.dispatcher.response(request)
         if callback:
             response.get_body_async(callback)
         return response
 
-    def _download_many(self, paths, params, callback):
-        return [self._get(path, params=params, callback=callback)
+    def _download_many(self, paths, params, callback, segments=1):
+        return [self._get(path, params=params, callback=callback,
+                          segments=segments)
                 for path in paths]
 
     def get_scenes_list(self, scene_type='ortho', order_by=None, count=None,
@@ -59,17 +163,185 @@ class Client(object):
         """
         Get metadata for a given scene.
 
-        .. todo:: Generalize to accept multiple scene ids.
+        See `get_scenes_metadata` for many scenes.
         """
         return self._get('scenes/%s/%s' % (scene_type, scene_id)).get_body()
 
+    def get_scenes_metadata(self, scene_ids, scene_type='ortho',
+                            ordered=False):
+        """
+        Get metadata for many scenes concurrently.
+
+        :param scene_ids:
+            Any iterable of scene ids, consumed as requests complete.
+        :param ordered:
+            Yield results in the order of `scene_ids` rather than as they
+            complete.
+        :returns:
+            A generator of `(scene_id, body, error)` tuples. A failed
+            request gives an `error` instead of stopping the others.
+        """
+        requests = {}
+        read = _read_body(self.dispatcher)
+
+        def submit(scene_id):
+            request = self._request('scenes/%s/%s' % (scene_type, scene_id))
+            future = self.dispatcher._dispatch_async(request, read)
+            requests[future] = request
+            return future
+
+        done = _bounded(scene_ids, submit, self.dispatcher.workers * 2,
+                        ordered)
+        for scene_id, future in done:
+            request = requests.pop(future)
+            try:
+                response = future.result()
+            except (APIException, RequestException) as ex:
+                yield scene_id, None, ex
+                continue
+            yield scene_id, models.JSON(response, self.dispatcher,
+                                        request), None
+
+    def _download_bounded(self, scene_ids, path, params, directory,
+                          callback, max_in_flight, ordered, segments=1,
+                          skip_unchanged=False, checksums=None):
+        records = {}
+
+        def destination(body):
+            if directory and body.name:
+                return os.path.join(directory, body.name)
+            return body.name
+
+        def submit(scene_id):
+            request = self._request(path % scene_id, models.Image, params,
+                                    segments)
+            record = {'start': time.time()}
+
+            def probe(session, response):
+                '''skip the download if a HEAD shows the file is unchanged,
+                the GET reports any error'''
+                response.close()
+                if response.status_code == 200:
+                    body = models.Image(response, self.dispatcher, request)
+                    local = destination(body)
+                    if local and body._unchanged(local):
+                        record.update(path=local, bytes=0, end=time.time())
+                        if callback:
+                            callback(body)
+                        return
+                write(session, self.dispatcher._dispatch_here(request))
+
+            def write(session, response):
+                check_status(response)
+                body = models.Image(response, self.dispatcher, request)
+                record['path'] = destination(body)
+                try:
+                    body.write(record['path'], callback,
+                               checksums=checksums)
+                finally:
+                    response.close()
+                record['bytes'] = len(body)
+                record['checksums'] = body.checksums
+                record['end'] = time.time()
+            if callable(skip_unchanged):
+                check = skip_unchanged(scene_id)
+            else:
+                check = skip_unchanged
+            if check:
+                head = models.Request(request.url, request.auth, params,
+                                      models.Image, method='HEAD')
+                future = self.dispatcher._dispatch_async(head, probe)
+            else:
+                future = self.dispatcher._dispatch_async(request, write)
+            records[future] = record
+            return future
+
+        window = max_in_flight or self.dispatcher.workers
+        done = _bounded(scene_ids, submit, window, ordered)
+        for scene_id, future in done:
+            record = records.pop(future)
+            error = future.exception()
+            end = record.get('end', time.time())
+            yield models.Download(scene_id, record.get('path'),
+                                  record.get('bytes', 0),
+                                  end - record['start'], error,
+                                  record.get('checksums'))
+
+    def download_scene_geotiffs(self, scene_ids, directory=None,
+                                scene_type='ortho', product='visual',
+                                callback=None, max_in_flight=None,
+                                ordered=False, segments=None,
+                                skip_unchanged=False, checksums=None):
+        """
+        Download full scene images with a bounded number in flight.
+
+        :param scene_ids:
+            Any iterable of scene ids, consumed only as downloads complete.
+        :param directory:
+            Where to write images, the working directory by default.
+        :param callback:
+            Progress callback as given to `Body.write`.
+        :param max_in_flight:
+            The most downloads submitted at once, the client's number of
+            workers by default.
+        :param skip_unchanged:
+            Send a HEAD request first and skip the download when the
+            existing file has the same size and is no older than the
+            server's Last-Modified. Skipped downloads report 0 bytes. May
+            be a function of the scene id to check only some scenes.
+        :param checksums:
+            Algorithms of `planet.api.checksum` to digest each image with
+            as it is written, checked against any digest the server sends.
+            The hex digests are in the `checksums` of each record, a
+            mismatch is its error.
+        :returns:
+            A generator of `planet.api.models.Download` records, one per
+            scene as each completes (or in input order if `ordered`). The
+            response of each is closed once written.
+        """
+        params = {
+            'product': product
+        }
+        return self._download_bounded(
+            scene_ids, 'scenes/%s/%%s/full' % scene_type, params, directory,
+            callback, max_in_flight, ordered, segments or self.segments,
+            skip_unchanged, checksums
+        )
+
+    def download_scene_thumbnails(self, scene_ids, directory=None,
+                                  scene_type='ortho', size='md', fmt='png',
+                                  callback=None, max_in_flight=None,
+                                  ordered=False, skip_unchanged=False,
+                                  checksums=None):
+        """
+        Download scene thumbnails with a bounded number in flight, see
+        `download_scene_geotiffs`.
+        """
+        params = {
+            'size': size,
+            'format': fmt
+        }
+        return self._download_bounded(
+            scene_ids, 'scenes/%s/%%s/thumb' % scene_type, params, directory,
+            callback, max_in_flight, ordered, skip_unchanged=skip_unchanged,
+            checksums=checksums
+        )
+
     def fetch_scene_geotiffs(self, scene_ids, scene_type='ortho',
-                             product='visual', callback=None):
+                             product='visual', callback=None, segments=None):
+        """
+        Fetch full scene images.
+
+        :param segments:
+            Number of byte ranges to fetch each image in concurrently, when
+            the server supports it. Defaults to the client's `segments`.
+        """
         params = {
             'product': product
         }
         paths = ['scenes/%s/%s/full' % (scene_type, sid) for sid in scene_ids]
-        return self._download_many(paths, params, callback)
+        return self._download_many(paths, params, callback,
+                                   segments or self.segments)
 
     def fetch_scene_thumbnails(self, scene_ids, scene_type='ortho', size='md',
                                fmt='png', callback=None):
@@ -80,6 +352,66 @@ class Client(object):
         paths = ['scenes/%s/%s/thumb' % (scene_type, sid) for sid in scene_ids]
         return self._download_many(paths, params, callback)
 
+    def _thumbnail(self, scene_id, scene_type, size, fmt, future=None):
+        path = 'scenes/%s/%s/thumb' % (scene_type, scene_id)
+        params = {
+            'size': size,
+            'format': fmt
+        }
+
+        def load():
+            response = future and future.result()
+            if response is None:
+                body = self._get(path, models.Image, params).get_body()
+                response = body.response
+            return response.content
+
+        return self.thumbnails.get((scene_type, scene_id, size, fmt), load)
+
+    def get_scene_thumbnail(self, scene_id, scene_type='ortho', size='md',
+                            fmt='png'):
+        """
+        Get a scene thumbnail as bytes, from the client's `thumbnails` cache
+        if it was fetched before.
+        """
+        return self._thumbnail(scene_id, scene_type, size, fmt)
+
+    def get_scene_thumbnails(self, scene_ids, scene_type='ortho', size='md',
+                             fmt='png', ordered=False):
+        """
+        Get thumbnails for many scenes concurrently as bytes, see
+        `get_scene_thumbnail`.
+
+        :returns:
+            A generator of `(scene_id, data, error)` tuples, as for
+            `get_scenes_metadata`.
+        """
+        params = {
+            'size': size,
+            'format': fmt
+        }
+        read = _read_body(self.dispatcher)
+
+        def submit(scene_id):
+            if (scene_type, scene_id, size, fmt) in self.thumbnails:
+                future = Future()
+                future.set_result(None)
+                return future
+            request = self._request(
+                'scenes/%s/%s/thumb' % (scene_type, scene_id), models.Image,
+                params)
+            return self.dispatcher._dispatch_async(request, read)
+
+        done = _bounded(scene_ids, submit, self.dispatcher.workers * 2,
+                        ordered)
+        for scene_id, future in done:
+            try:
+                data = self._thumbnail(scene_id, scene_type, size, fmt, future)
+            except (APIException, RequestException) as ex:
+                yield scene_id, None, ex
+                continue
+            yield scene_id, data, None
+
     def list_mosaics(self):
         """
         List all mosaics.
@@ -0,0 +1,79 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ConcurrencyLimit(object):
+    '''Bounds the number of requests in flight between `floor` and `ceiling`.
+
+    When they differ the limit adapts (AIMD): it is multiplied by `decrease`
+    when the server signals overload or a response takes `spike` times
+    longer than the running average, and otherwise grows by one for each
+    full window of healthy responses. Only one decrease happens per round
+    trip, so a burst of 429s from requests already in flight counts once.
+    '''
+
+    def __init__(self, floor=1, ceiling=16, start=None, decrease=.5,
+                 spike=3.):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.decrease = decrease
+        self.spike = spike
+        self.in_flight = 0
+        self.latency = None
+        self._limit = float(start or floor)
+        self._epoch = 0
+        self._cond = threading.Condition()
+
+    @property
+    def concurrency(self):
+        '''the current number of requests allowed in flight'''
+        return int(self._limit)
+
+    def acquire(self):
+        '''wait for a slot, returning a token to pass to `observe`'''
+        with self._cond:
+            while self.in_flight >= self.concurrency:
+                self._cond.wait()
+            self.in_flight += 1
+            return self._epoch
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def observe(self, token, latency, overloaded=False):
+        '''adjust the limit with the outcome of a request'''
+        with self._cond:
+            before = self.concurrency
+            average = self.latency
+            spiked = average is not None and latency > self.spike * average
+            if overloaded or spiked:
+                if token == self._epoch:
+                    self._epoch += 1
+                    self._limit = max(float(self.floor),
+                                      self._limit * self.decrease)
+            else:
+                self._limit = min(float(self.ceiling),
+                                  self._limit + 1. / self._limit)
+                self._cond.notify_all()
+            self.latency = latency if average is None else (
+                .9 * average + .1 * latency)
+            if self.concurrency != before:
+                log.info('concurrency %s -> %s', before, self.concurrency)
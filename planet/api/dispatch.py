@@ -12,31 +12,331 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import Future
+import json
+import logging
+import threading
+import time
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.exceptions import Timeout
 from requests_futures.sessions import FuturesSession
 from . utils import check_status
+from . models import JSON
 from . models import Response
+from . auth import KeyPool
 from . exceptions import InvalidAPIKey
+from . retry import RetryPolicy
+from . concurrency import ConcurrencyLimit
+
+log = logging.getLogger(__name__)
+
+# statuses signalling the server wants fewer requests
+_overloaded = (429, 503)
+
+
+class _Flight(object):
+    '''a request in flight, with the futures and callbacks of identical
+    requests made since, which share its outcome'''
+
+    def __init__(self, key, request):
+        self.key = key
+        self.request = request
+        self.followers = []
+
+
+def _parse(response):
+    '''parse a JSON body shared by several requests once for all of them,
+    leaving a body that doesn't parse to fail for each'''
+    try:
+        response.parsed = response.json()
+    except ValueError:
+        pass
+
+
+def _flight_key(request, kw):
+    params = sorted((k, v) for k, v in (kw['params'] or {}).items()
+                    if v is not None)
+    headers = sorted((kw['headers'] or {}).items())
+    if isinstance(request.auth, KeyPool):
+        auth = id(request.auth)
+    else:
+        auth = request.auth.value
+    return json.dumps([request.method, request.url, params, headers, auth],
+                      sort_keys=True, default=str)
 
 
 class RequestsDispatcher(object):
+    '''
+    :param limit:
+        Optional `ConcurrencyLimit` adapting the requests in flight at
+        runtime, up to its ceiling. By default `workers` are always allowed.
+    :param hooks:
+        Callables given each event, see `planet.api.metrics`.
+    :param writer:
+        Optional `planet.api.writer.WriterPool` writing bodies to disk in
+        place of the threads reading them.
+    :param coalesce:
+        Which identical GET requests in flight at once share one request
+        and response: `json` for JSON bodies, `all` to include images, read
+        into memory to be shared, or None for none. JSON bodies shared this
+        way are parsed once, and their `get` gives each the same value.
+
+    A dispatcher may be shared by several clients, so they share its
+    workers and its pool of connections, which keeps one connection per
+    worker open to each host.
+    '''
+
+    def __init__(self, workers=4, cache=None, retry=None, limit=None,
+                 hooks=None, writer=None, coalesce='json'):
+        self.limit = limit or ConcurrencyLimit(workers, workers)
+        self.workers = max(workers, self.limit.ceiling)
+        self.session = FuturesSession(max_workers=self.workers)
+        for prefix in ('http://', 'https://'):
+            self.session.mount(prefix,
+                               HTTPAdapter(pool_maxsize=self.workers))
+        self.cache = cache
+        self.retry = retry or RetryPolicy()
+        self.hooks = list(hooks or [])
+        self.writer = writer
+        self.coalesce = coalesce
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        if self.hooks:
+            fields['event'] = event
+            for hook in self.hooks:
+                hook(fields)
 
-    def __init__(self, workers=4):
-        self.session = FuturesSession(max_workers=workers)
+    def warm(self, url, connections=None):
+        '''open connections to the host of url ahead of use, one for each
+        worker by default, returning how many requests were answered'''
+        connections = min(connections or self.workers, self.workers)
+        futures = [
+            self.session.executor.submit(Session.request, self.session,
+                                         'HEAD', url)
+            for _ in range(connections)
+        ]
+        answered = 0
+        for future in futures:
+            try:
+                future.result()
+                answered += 1
+            except (ConnectionError, Timeout) as ex:
+                log.info('warming %s failed: %s', url, ex)
+        return answered
 
     def response(self, request):
         return Response(request, self)
 
-    def _dispatch_async(self, request, callback):
-        auth = request.auth
-        if not auth:
+    def _prepare(self, request):
+        if not request.auth:
             raise InvalidAPIKey('No API key provided')
-        self.session.headers.update({
-            'Authorization': 'api-key %s' % auth.value
-        })
-        return self.session.get(request.url, params=request.params,
-                                stream=True, background_callback=callback)
+        return dict(params=request.params, headers=request.headers,
+                    stream=True)
+
+    def _attempt(self, request, kw):
+        '''send the request once with auth attached, taking a key from the
+        request's `KeyPool` if it has several'''
+        pool = request.auth if isinstance(request.auth, KeyPool) else None
+        key = pool.acquire() if pool else request.auth
+        headers = dict(kw['headers'] or {})
+        headers['Authorization'] = 'api-key %s' % key.value
+        response = None
+        try:
+            response = Session.request(self.session, request.method,
+                                       request.url, params=kw['params'],
+                                       headers=headers, stream=kw['stream'])
+            return response, None
+        except (ConnectionError, Timeout) as ex:
+            return None, ex
+        finally:
+            if pool:
+                pool.release(key, response)
+
+    def _emit_attempt(self, request, response, error, attempt, queue_wait,
+                      ttfb, in_flight):
+        if not self.hooks:
+            return
+        status = None if response is None else response.status_code
+        error = None if error is None else type(error).__name__
+        self.emit('request', url=request.url, method=request.method,
+                  status=status, error=error, attempt=attempt, ttfb=ttfb,
+                  queue_wait=queue_wait, in_flight=in_flight)
+
+    def _switch_key(self, request, response):
+        '''whether a request refused for its key's quota can be retried
+        at once with another key, rather than waiting on Retry-After'''
+        pool = request.auth
+        return (isinstance(pool, KeyPool) and response is not None and
+                response.status_code == 429 and pool.ready())
+
+    def _coalesced(self, request):
+        if request.method != 'GET' or self.coalesce is None:
+            return False
+        return self.coalesce == 'all' or issubclass(request.body_type, JSON)
+
+    def _read(self, response):
+        '''the body of response, read into memory if it wasn't already with
+        a body event'''
+        if response._content_consumed:
+            return response.content
+        start = time.time()
+        content = response.content
+        self.emit('body', url=response.url, bytes=len(content),
+                  duration=response.elapsed.total_seconds() + time.time() -
+                  start)
+        return content
+
+    def _land(self, flight, response, error):
+        '''pass the outcome of a flight to its followers, reading the
+        response into memory if there are any'''
+        with self._flights_lock:
+            del self._flights[flight.key]
+        if flight.followers and response is not None:
+            try:
+                self._read(response)
+            except Exception as ex:
+                error = ex
+            else:
+                if response.ok and issubclass(flight.request.body_type, JSON):
+                    _parse(response)
+        for future, callback in flight.followers:
+            if callback:
+                self.session.executor.submit(self._settle, future, response,
+                                             error, callback)
+            else:
+                self._settle(future, response, error, None)
+        return response, error
+
+    def _settle(self, future, response, error, callback):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._deliver(response, error, callback))
+        except Exception as ex:
+            future.set_exception(ex)
+
+    def _send(self, request, kw, callback=None, limited=True, queued=None,
+              flight=None):
+        '''send the request from the calling thread, retrying as the retry
+        policy allows, and pass the final response to callback. unless
+        `limited` is false, this holds a slot of the concurrency limit until
+        the callback is done. the outcome is shared with the followers of
+        `flight`, if given, before the callback is called.'''
+        try:
+            response, error = self._exchange(request, kw, limited, queued)
+        except Exception as ex:
+            if flight:
+                self._land(flight, None, ex)
+            raise
+        try:
+            if flight:
+                response, error = self._land(flight, response, error)
+            return self._deliver(response, error, callback)
+        finally:
+            if limited:
+                self.limit.release()
+
+    def _deliver(self, response, error, callback):
+        if error is not None:
+            raise error
+        if callback:
+            callback(self.session, response)
+        return response
+
+    def _exchange(self, request, kw, limited, queued):
+        '''the final response or error of the request after any retries,
+        holding a slot of the concurrency limit if `limited`'''
+        attempt = 0
+        while True:
+            if queued is None:
+                queued = time.time()
+            if limited:
+                token = self.limit.acquire()
+            start = time.time()
+            in_flight = self.limit.in_flight
+            try:
+                response, error = self._attempt(request, kw)
+            except Exception:
+                if limited:
+                    self.limit.release()
+                raise
+            self._emit_attempt(request, response, error, attempt,
+                               start - queued, time.time() - start, in_flight)
+            if limited:
+                overloaded = error is not None or \
+                    response.status_code in _overloaded
+                self.limit.observe(token, time.time() - start, overloaded)
+            if not self.retry.should_retry(attempt, response, error):
+                return response, error
+            if response is not None:
+                response.close()
+            if limited:
+                self.limit.release()
+            if not self._switch_key(request, response):
+                time.sleep(self.retry.delay(attempt, response))
+            attempt += 1
+            queued = None
+
+    def _send_cached(self, request, callback):
+        '''answer the request from the cache in a worker, sending any
+        request the cache needs from the same thread'''
+        response = self.cache.response(request, self)
+        return self._deliver(response, None, callback)
+
+    def _dispatch_async(self, request, callback, limited=True):
+        kw = self._prepare(request)
+        if self.cache is not None and self.cache.accepts(request):
+            return self.session.executor.submit(self._send_cached, request,
+                                                callback)
+        flight = None
+        if self._coalesced(request):
+            key = _flight_key(request, kw)
+            with self._flights_lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight(key, request)
+                else:
+                    # wait on the identical request rather than a worker
+                    future = Future()
+                    flight.followers.append((future, callback))
+                    flight = None
+            if flight is None:
+                self.emit('coalesced', url=request.url, method=request.method)
+                return future
+        future = self.session.executor.submit(self._send, request, kw,
+                                              callback, limited, time.time(),
+                                              flight)
+        if flight:
+            future.add_done_callback(
+                lambda f: self._cancelled(f, flight, kw, limited))
+        return future
+
+    def _cancelled(self, future, flight, kw, limited):
+        '''if the leading request of flight was cancelled before it was
+        sent, send it again for its followers or end the flight'''
+        if not future.cancelled():
+            return
+        with self._flights_lock:
+            if not flight.followers:
+                del self._flights[flight.key]
+                return
+        self.session.executor.submit(self._send, flight.request, kw, None,
+                                     limited, time.time(), flight)
 
     def _dispatch(self, request, callback=None):
+        if self.cache is not None and self.cache.accepts(request):
+            return self.cache.response(request, self)
         response = self._dispatch_async(request, callback).result()
         check_status(response)
         return response
+
+    def _dispatch_here(self, request):
+        '''dispatch in the calling thread rather than the worker pool, for
+        use from within a worker where waiting on the pool could deadlock'''
+        response = self._send(request, self._prepare(request), limited=False)
+        check_status(response)
+        return response
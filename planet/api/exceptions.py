@@ -40,3 +40,8 @@ class OverQuota(APIException):
 
 class ServerError(APIException):
     pass
+
+
+class ChecksumMismatch(APIException):
+    '''a body written differs from the digest the server sent'''
+    pass
@@ -0,0 +1,196 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Instrumentation of the requests made by a client.
+
+Hooks are callables given to `Client(hooks=[...])` and called with a dict
+for each event:
+
+`request`
+    one attempt of a request: `url`, `method`, `status` (None if it
+    raised), `error`, `attempt` (0 unless retried), `ttfb` (seconds until
+    the response headers), `queue_wait` (seconds between submission and
+    the attempt starting) and `in_flight` (requests in flight at the start)
+`body`
+    a body written to a file or read into memory: `url`, `bytes` and
+    `duration` (seconds from the request to the last byte)
+`coalesced`
+    a request answered by an identical one in flight: `url` and `method`
+
+`Metrics` aggregates these for export in the Prometheus text format and
+`EventLog` writes each one as a line of JSON.
+'''
+
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds of histogram buckets
+latency_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60,
+                   120, 300)
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield '%s_bucket{le="%s"} %d' % (name, bound, total)
+        yield '%s_bucket{le="+Inf"} %d' % (name, self.count)
+        yield '%s_sum %f' % (name, self.sum)
+        yield '%s_count %d' % (name, self.count)
+
+
+class Metrics(object):
+    '''Hook aggregating events into counters and latency histograms'''
+
+    def __init__(self, prefix='planet', buckets=latency_buckets):
+        self.prefix = prefix
+        self.statuses = {}
+        self.errors = {}
+        self.retries = 0
+        self.coalesced = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.ttfb = _Histogram(buckets)
+        self.queue_wait = _Histogram(buckets)
+        self.duration = _Histogram(buckets)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            if event['event'] == 'request':
+                self._request(event)
+            elif event['event'] == 'body':
+                self.bytes += event['bytes']
+                self.duration.observe(event['duration'])
+            elif event['event'] == 'coalesced':
+                self.coalesced += 1
+
+    def _request(self, event):
+        if event['error']:
+            self.errors[event['error']] = self.errors.get(event['error'],
+                                                          0) + 1
+        else:
+            status = event['status']
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.ttfb.observe(event['ttfb'])
+        if event['attempt']:
+            self.retries += 1
+        self.queue_wait.observe(event['queue_wait'])
+        self.in_flight = event['in_flight']
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': sum(self.statuses.values()),
+                'statuses': dict(self.statuses),
+                'errors': dict(self.errors),
+                'retries': self.retries,
+                'coalesced': self.coalesced,
+                'bytes': self.bytes,
+                'max_in_flight': self.max_in_flight
+            }
+
+    def _family(self, name, kind, help, lines):
+        name = '%s_%s' % (self.prefix, name)
+        yield '# HELP %s %s' % (name, help)
+        yield '# TYPE %s %s' % (name, kind)
+        for line in lines(name):
+            yield line
+
+    def prometheus(self):
+        '''the metrics in the Prometheus text exposition format'''
+        def labelled(label, counts):
+            return lambda name: ('%s{%s="%s"} %d' % (name, label, k, v)
+                                 for k, v in sorted(counts.items()))
+
+        def value(v):
+            return lambda name: ['%s %s' % (name, v)]
+        with self._lock:
+            families = [
+                ('requests_total', 'counter',
+                 'Responses received, by status code.',
+                 labelled('status', self.statuses)),
+                ('request_errors_total', 'counter',
+                 'Requests that raised, by exception.',
+                 labelled('error', self.errors)),
+                ('request_retries_total', 'counter',
+                 'Attempts that retried a failed request.',
+                 value(self.retries)),
+                ('requests_coalesced_total', 'counter',
+                 'Requests answered by an identical request in flight.',
+                 value(self.coalesced)),
+                ('body_bytes_total', 'counter',
+                 'Bytes of response bodies written or read.',
+                 value(self.bytes)),
+                ('requests_in_flight', 'gauge',
+                 'Requests in flight at the last request.',
+                 value(self.in_flight)),
+                ('request_ttfb_seconds', 'histogram',
+                 'Time to the response headers.', self.ttfb.lines),
+                ('request_queue_wait_seconds', 'histogram',
+                 'Time requests waited before being sent.',
+                 self.queue_wait.lines),
+                ('body_duration_seconds', 'histogram',
+                 'Time from request to the last byte read.',
+                 self.duration.lines),
+            ]
+            lines = []
+            for family in families:
+                lines.extend(self._family(*family))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''write the Prometheus text to path by way of a temporary file, so
+        a textfile collector never reads it partly written'''
+        partial = '%s.%s' % (path, os.getpid())
+        with open(partial, 'w') as fp:
+            fp.write(self.prometheus())
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(partial, path)
+
+
+class EventLog(object):
+    '''Hook writing each event as a line of JSON to a file object'''
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        event = dict(event, time=time.time())
+        line = json.dumps(event, sort_keys=True) + '\n'
+        with self._lock:
+            self.fp.write(line)
+            self.fp.flush()
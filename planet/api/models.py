@@ -14,9 +14,68 @@
 
 from .utils import get_filename
 from .utils import check_status
+from .utils import stream_array
+from .checksum import Digests
+from .exceptions import ChecksumMismatch
+from collections import namedtuple
 from datetime import datetime
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import ConnectionError
+import os
+import socket
+import threading
+import time
+
+try:
+    from http.client import HTTPException
+    from queue import Full, Queue
+except ImportError:
+    from httplib import HTTPException
+    from Queue import Full, Queue
 
 chunk_size = 32 * 1024
+# suffix of the file a body is written to until it is complete
+partial_suffix = '.part'
+# number of times an interrupted body is resumed before giving up
+resume_attempts = 5
+# smallest byte range worth fetching as a separate segment
+segment_min_size = 1024 * 1024
+# whether bodies are read into reused buffers where the response allows
+fast_write = True
+# bytes written between progress callbacks when reading into buffers
+progress_interval = 1024 * 1024
+
+
+class _Buffers(object):
+    '''bytearrays of one size, kept for reuse once released'''
+
+    def __init__(self, size, keep=64):
+        self.size = size
+        self.keep = keep
+        self._free = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.size)
+
+    def put(self, buffer):
+        with self._lock:
+            if len(self._free) < self.keep:
+                self._free.append(buffer)
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def _buffer_pool(size):
+    with _buffers_lock:
+        if size not in _buffers:
+            _buffers[size] = _Buffers(size)
+        return _buffers[size]
 
 
 class Response(object):
@@ -28,7 +87,8 @@ class Response(object):
         self._future = None
 
     def _create_body(self, response):
-        return self.request.body_type(response, self._dispatcher)
+        return self.request.body_type(response, self._dispatcher,
+                                      self.request)
 
     def get_body(self):
         if self._body is None:
@@ -57,87 +117,475 @@ class Response(object):
             return self._body
 
 
+# the outcome of one download, error is None if it succeeded and checksums
+# holds hex digests by algorithm when asked for
+Download = namedtuple('Download', 'id path bytes duration error checksums')
+Download.__new__.__defaults__ = (None,)
+
+
 class Request(object):
 
-    def __init__(self, url, auth, params=None, body_type=Response):
+    def __init__(self, url, auth, params=None, body_type=Response,
+                 headers=None, segments=1, method='GET'):
         self.url = url
         self.auth = auth
         self.params = params
         self.body_type = body_type
+        self.headers = headers
+        self.segments = segments
+        self.method = method
 
 
 class Body(object):
 
-    def __init__(self, http_response, dispatcher):
+    def __init__(self, http_response, dispatcher, request=None):
         self.response = http_response
         self._dispatcher = dispatcher
+        self._request = request
         self.size = int(self.response.headers.get('content-length', 0))
         self.name = get_filename(self.response)
+        self.segments = request.segments if request else 1
+        self._created = time.time()
+        # hex digests by algorithm of the body last written with checksums
+        self.checksums = None
+        self._digests = None
 
     def __len__(self):
         return self.size
 
     def __iter__(self):
-        return (c for c in self.response.iter_content(chunk_size=chunk_size))
+        return (c for c in self.response.iter_content(
+            chunk_size=self._chunk_size()))
+
+    def _writer(self):
+        return getattr(self._dispatcher, 'writer', None)
+
+    def _chunk_size(self):
+        writer = self._writer()
+        return writer.chunk_size if writer else chunk_size
+
+    def _open(self, path, mode):
+        '''open path for writing, by way of the dispatcher's writer pool
+        if it has one'''
+        writer = self._writer()
+        return writer.open(path, mode) if writer else open(path, mode)
 
     def last_modified(self):
         lm = self.response.headers['last-modified']
         return datetime.strptime(lm, '%a, %d %b %Y %H:%M:%S GMT')
 
     def get_raw(self):
-        return self.response.content.decode('utf-8')
+        return self._dispatcher._read(self.response).decode('utf-8')
+
+    def _validator(self):
+        headers = self.response.headers
+        return headers.get('etag') or headers.get('last-modified')
+
+    def _range_request(self, start, end=''):
+        headers = {'Range': 'bytes=%s-%s' % (start, end)}
+        validator = self._validator()
+        if validator:
+            headers['If-Range'] = validator
+        # from the url asked for, not the one redirected to, so the auth
+        # header is dropped again on the way to another host
+        return Request(self._request.url, self._request.auth,
+                       self._request.params, headers=headers)
+
+    def _resume(self, fp, offset):
+        '''replace the response with one starting at offset, returning the
+        offset the new response actually starts at'''
+        self.response.close()
+        request = self._range_request(offset)
+        self.response = self._dispatcher._dispatch_here(request)
+        if not _starts_at(self.response, offset):
+            # range ignored or resource changed, start over
+            fp.seek(0)
+            fp.truncate()
+            if self._digests:
+                self._digests.reset()
+            return 0
+        return offset
 
-    def _write(self, fp, callback):
-        total = 0
+    def _readinto(self, response):
+        '''the readinto of the connection the response is read from, if it
+        can be read into buffers without decoding'''
+        # a response shared by coalesced requests has been read already
+        if not fast_write or response._content_consumed:
+            return None
+        encoding = response.headers.get('content-encoding', 'identity')
+        if encoding != 'identity':
+            return None
+        # python 2's httplib has no readinto, iter_content is used instead
+        return getattr(getattr(response.raw, '_fp', None), 'readinto', None)
+
+    def _copy(self, response, fp, progress, limit=None):
+        '''write the response to fp, up to limit bytes, calling progress
+        with the bytes written. where possible the response is read
+        straight into reused buffers and progress is called in batches.'''
+        readinto = self._readinto(response)
+        if readinto is None:
+            for chunk in response.iter_content(chunk_size=self._chunk_size()):
+                if limit is not None:
+                    chunk = chunk[:limit]
+                    limit -= len(chunk)
+                fp.write(chunk)
+                if self._digests:
+                    self._digests.update(chunk)
+                progress(len(chunk))
+                if limit == 0:
+                    break
+            return
+        buffers = _buffer_pool(self._chunk_size())
+        # a writer pool writes later, releasing the buffer once written
+        write_buffer = getattr(fp, 'write_buffer', None)
+        batch = 0
+        try:
+            while limit is None or limit > 0:
+                buffer = buffers.get()
+                view = memoryview(buffer)
+                if limit is not None and limit < len(buffer):
+                    view = view[:limit]
+                try:
+                    size = readinto(view)
+                except (socket.error, HTTPException) as ex:
+                    buffers.put(buffer)
+                    raise ChunkedEncodingError(ex)
+                if not size:
+                    buffers.put(buffer)
+                    break
+                if self._digests:
+                    self._digests.update(view[:size])
+                if write_buffer:
+                    write_buffer(view[:size], buffers.put, buffer)
+                else:
+                    fp.write(view[:size])
+                    buffers.put(buffer)
+                if limit is not None:
+                    limit -= size
+                batch += size
+                if batch >= progress_interval:
+                    progress(batch)
+                    batch = 0
+        finally:
+            if batch:
+                progress(batch)
+        if limit is None:
+            # read to the end, so the connection can be reused
+            response.raw.release_conn()
+
+    def _write(self, fp, callback, offset=0):
+        counts = {'total': offset, 'written': 0}
         if not callback:
             callback = lambda x: None
-        for chunk in self:
-            fp.write(chunk)
-            size = len(chunk)
-            total += size
+
+        def progress(size):
+            counts['total'] += size
+            counts['written'] += size
             callback(size)
+        attempts = resume_attempts
+        resume = offset > 0 and offset != self.size
+        if offset and offset == self.size:
+            # already complete
+            self.response.close()
+        else:
+            while True:
+                try:
+                    if resume:
+                        counts['total'] = self._resume(fp, counts['total'])
+                    self._copy(self.response, fp, progress)
+                    break
+                except (ChunkedEncodingError, ConnectionError):
+                    if self._request is None or attempts == 0:
+                        raise
+                    attempts -= 1
+                    resume = True
         # seems some responses don't have a content-length header
         if self.size is 0:
-            self.size = total
+            self.size = counts['total']
+        if self._digests:
+            self.checksums = self._digests.hexdigests()
+            self._digests.verify(self.response.headers)
+        self._emit_written(counts['written'])
         callback(self)
 
-    def write(self, file=None, callback=None):
+    def _emit_written(self, bytes):
+        elapsed = self.response.elapsed.total_seconds()
+        self._dispatcher.emit('body', url=self.response.url, bytes=bytes,
+                              duration=elapsed + time.time() - self._created)
+
+    def _partial_offset(self, partial):
+        '''the number of bytes of partial that can be resumed from'''
+        if not os.path.exists(partial) or self._request is None:
+            return 0
+        offset = os.path.getsize(partial)
+        if self.size and offset > self.size:
+            return 0
+        if 'last-modified' in self.response.headers:
+            changed = self.last_modified()
+            written = datetime.utcfromtimestamp(os.path.getmtime(partial))
+            if changed > written:
+                return 0
+        return offset
+
+    def _unchanged(self, path):
+        '''whether the file at path already holds this body, judged by its
+        size and, when the server provides it, modification time'''
+        if not self.size or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != self.size:
+            return False
+        if 'last-modified' in self.response.headers:
+            written = datetime.utcfromtimestamp(os.path.getmtime(path))
+            return self.last_modified() <= written
+        return True
+
+    def _segmented(self):
+        accept = self.response.headers.get('accept-ranges', '')
+        # ranges arrive out of order, so are not hashed as they are written
+        return (self.segments > 1 and self._request is not None and
+                self._digests is None and
+                'bytes' in accept and
+                self.size >= self.segments * segment_min_size)
+
+    def _write_range(self, path, response, start, end, callback):
+        written = []
+
+        def progress(size):
+            written.append(size)
+            callback(size)
+        with self._open(path, 'r+b') as fp:
+            fp.seek(start)
+            self._copy(response, fp, progress, end - start + 1)
+        response.close()
+        remaining = end - start + 1 - sum(written)
+        if remaining:
+            raise ChunkedEncodingError(
+                'segment %s-%s ended %s bytes short' % (start, end, remaining)
+            )
+
+    def _write_segments(self, path, callback):
+        '''write the body to a preallocated file, fetching all but the first
+        byte range concurrently over the dispatcher's workers'''
+        with open(path, 'wb') as fp:
+            fp.truncate(self.size)
+        step = -(-self.size // self.segments)
+        ranges = [(start, min(start + step, self.size) - 1)
+                  for start in range(0, self.size, step)]
+        written = dict.fromkeys([start for start, _ in ranges], 0)
+
+        def progress(start):
+            def track(size):
+                written[start] += size
+                if callback:
+                    callback(size)
+            return track
+
+        def handler(start, end):
+            def write(session, response):
+                check_status(response)
+                if not _starts_at(response, start):
+                    raise ChunkedEncodingError('range %s-%s ignored' %
+                                               (start, end))
+                self._write_range(path, response, start, end,
+                                  progress(start))
+            return write
+
+        # the ranges share the concurrency slot held for this body
+        futures = [
+            self._dispatcher._dispatch_async(self._range_request(start, end),
+                                             handler(start, end), False)
+            for start, end in ranges[1:]
+        ]
+        try:
+            start, end = ranges[0]
+            self._write_range(path, self.response, start, end,
+                              progress(start))
+            for future, (start, end) in zip(futures, ranges[1:]):
+                if future.cancel():
+                    # not started yet, fetch it here instead of waiting on
+                    # a pool that may be busy with this very write
+                    request = self._range_request(start, end)
+                    response = self._dispatcher._dispatch_here(request)
+                    handler(start, end)(None, response)
+                else:
+                    future.result()
+        except Exception:
+            for future in futures:
+                future.cancel() or future.exception()
+            # keep only the complete leading ranges so a later write resumes
+            offset = 0
+            for start, end in ranges:
+                offset += written[start]
+                if written[start] <= end - start:
+                    break
+            with open(path, 'r+b') as fp:
+                fp.truncate(offset)
+            raise
+        self._emit_written(self.size)
+        if callback:
+            callback(self)
+
+    def _write_partial(self, file, callback):
+        partial = file + partial_suffix
+        offset = self._partial_offset(partial)
+        if not offset and self._segmented():
+            self._write_segments(partial, callback)
+        else:
+            if offset and self._digests:
+                self._digests.update_file(partial, offset)
+            try:
+                with self._open(partial, 'ab' if offset else 'wb') as fp:
+                    self._write(fp, callback, offset)
+            except ChecksumMismatch:
+                # not to be resumed from
+                os.remove(partial)
+                raise
+        if os.path.exists(file):
+            os.remove(file)
+        os.rename(partial, file)
+
+    def write(self, file=None, callback=None, skip_unchanged=False,
+              checksums=None):
+        '''write the body to the provided file object or path. when writing
+        to a path, content goes to a partial file first which is resumed
+        from on a later attempt and only moved into place once complete.
+        with `skip_unchanged`, an existing file of the same size and no
+        older than the body is kept and the body is not read.
+        `checksums` names algorithms of `planet.api.checksum` to digest the
+        body with as it is written, setting `checksums` to the hex digests
+        and raising `ChecksumMismatch` if the server sent a different one.
+        these bodies are not fetched in segments.'''
         if not file:
             file = self.name
         if not file:
             raise ValueError('no file name provided or discovered in response')
-        if hasattr(file, 'write'):
-            self._write(file, callback)
-        else:
-            with open(file, 'wb') as fp:
-                self._write(fp, callback)
+        self.checksums = None
+        self._digests = Digests(checksums) if checksums else None
+        try:
+            if hasattr(file, 'write'):
+                self._write(file, callback)
+            elif skip_unchanged and self._unchanged(file):
+                self.response.close()
+                if callback:
+                    callback(self)
+            else:
+                self._write_partial(file, callback)
+        finally:
+            self._digests = None
+
+
+def _starts_at(response, offset):
+    content_range = response.headers.get('content-range', '')
+    return content_range.startswith('bytes %d-' % offset)
 
 
 class JSON(Body):
 
     def get(self):
+        # parsed once already if shared by coalesced requests
+        if hasattr(self.response, 'parsed'):
+            return self.response.parsed
+        self._dispatcher._read(self.response)
         return self.response.json()
 
 
 class Scenes(JSON):
 
+    # top level members other than features, read by iter_features
+    meta = None
+    # whether iter_features has read the whole page
+    _streamed = False
+
     def next(self):
-        links = self.get()['links']
+        if self.meta is not None:
+            # the content has been consumed by iter_features
+            if not self._streamed and 'links' not in self.meta:
+                raise ValueError('read all features of the page with '
+                                 'iter_features before the next page')
+            links = self.meta.get('links', {})
+        else:
+            links = self.get()['links']
         next = links.get('next', None)
         if next:
-            request = Request(next, body_type=Scenes)
+            auth = self._request.auth if self._request else None
+            request = Request(next, auth, body_type=Scenes)
             return self._dispatcher.response(request).get_body()
 
-    def iter(self, pages=None):
+    def iter_features(self):
+        '''iterate over the features of this page as they are parsed from
+        the response, holding only one in memory at a time. As they are
+        read, other members such as `count` and `links` are put in `meta`
+        since the response content cannot be read again with `get`.'''
+        self.meta = {}
+        for feature in stream_array(self, 'features', self.meta):
+            yield feature
+        self._streamed = True
+
+    def iter(self, pages=None, prefetch=2, stream=False):
+        '''iterate over this and subsequent pages. Up to `prefetch` pages are
+        fetched in the background while the current page is processed.
+        With `stream`, pages are left unread for `iter_features` and so are
+        not fetched ahead, as the link to the next page is in the content.'''
         pages = int(10e10) if pages is None else pages
+        if prefetch > 0 and pages > 1 and not stream:
+            return self._prefetch(pages, prefetch)
+        return self._iter(pages)
+
+    def _iter(self, pages):
         page = self
-        if pages > 0:
-            yield page
-            pages -= 1
-        while pages > 0:
-            page = page.next()
+        while page is not None and pages > 0:
             yield page
             pages -= 1
+            if pages > 0:
+                page = page.next()
+
+    def _prefetch(self, pages, prefetch):
+        buffer = Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def fetch():
+            page = self
+            remaining = pages - 1
+            try:
+                while remaining > 0:
+                    page = page.next()
+                    if page is None:
+                        break
+                    # read the body here rather than in the consumer
+                    page.response.content
+                    if not put(page):
+                        return
+                    remaining -= 1
+            except Exception as ex:
+                put(ex)
+                return
+            put(None)
+
+        # read before sharing with the fetching thread
+        self.response.content
+        fetcher = threading.Thread(target=fetch)
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            yield self
+            while True:
+                page = buffer.get()
+                if isinstance(page, Exception):
+                    raise page
+                if page is None:
+                    break
+                yield page
+        finally:
+            stop.set()
 
 
 class Image(Body):
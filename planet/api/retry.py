@@ -0,0 +1,71 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+
+from requests.exceptions import ConnectionError
+from requests.exceptions import Timeout
+
+from .utils import retry_after as _retry_after
+
+
+class RetryPolicy(object):
+    '''Decides whether a failed request is sent again and how long to wait
+    first.
+
+    :param retries: maximum retries of any one request
+    :param budget: maximum retries across all requests, or None for no limit
+    :param backoff: base delay in seconds, doubled with each retry
+    :param max_backoff: upper bound of the delay before jitter, and of a
+        server's Retry-After
+    :param statuses: response status codes that are retried
+    '''
+
+    def __init__(self, retries=5, budget=None, backoff=.5, max_backoff=60,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.budget = budget
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def retryable(self, response=None, error=None):
+        if error is not None:
+            return isinstance(error, (ConnectionError, Timeout))
+        return response.status_code in self.statuses
+
+    def _take(self):
+        with self._lock:
+            if self.budget is not None and self.retried >= self.budget:
+                return False
+            self.retried += 1
+            return True
+
+    def should_retry(self, attempt, response=None, error=None):
+        '''whether to retry after `attempt` previous retries of a request
+        that ended in `response` or raised `error`'''
+        return (attempt < self.retries and
+                self.retryable(response, error) and self._take())
+
+    def delay(self, attempt, response=None):
+        '''seconds to wait before the next retry, honoring Retry-After'''
+        if response is not None:
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
@@ -13,9 +13,14 @@
 # limitations under the License.
 
 from datetime import datetime
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
 from . import exceptions
+import codecs
+import json
 import os
 import re
+import time
 
 _ISO_FMT = '%Y-%m-%dT%H:%M:%S.%f+00:00'
 
@@ -23,8 +28,13 @@ _ISO_FMT = '%Y-%m-%dT%H:%M:%S.%f+00:00'
 def check_status(response):
     '''check the status of the response and if needed raise an APIException'''
     status = response.status_code
-    if status == 200:
+    if status in (200, 206):
         return
+    raise status_exception(status, response.text)
+
+
+def status_exception(status, text):
+    '''the APIException to raise for an unexpected response status'''
     exception = {
         400: exceptions.BadQuery,
         401: exceptions.InvalidAPIKey,
@@ -35,9 +45,23 @@ def check_status(response):
     }.get(status, None)
 
     if exception:
-        raise exception(response.text)
+        return exception(text)
+
+    return exceptions.APIException('%s: %s' % (status, text))
+
 
-    raise exceptions.APIException('%s: %s' % (status, response.text))
+def retry_after(response):
+    '''seconds the response asks to wait before retrying, or None'''
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date:
+        return max(0, mktime_tz(date) - time.time())
 
 
 def get_filename(response):
@@ -47,10 +71,88 @@ def get_filename(response):
         return match.group(1)
 
 
-def write_to_file(directory=None, callback=None):
+class _JSONStream(object):
+    '''decodes JSON values one at a time from an iterable of byte chunks'''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def _more(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.exhausted = True
+            return False
+        self.buf = self.buf[self.pos:] + self.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                raise ValueError('unexpected end of JSON')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('expected %r at %r' % (char, self.buf[self.pos:]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a value ending with the buffer may continue in the next
+                # chunk (numbers for example)
+                if end < len(self.buf) or self.exhausted:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.exhausted:
+                    raise
+            # at least double what is buffered so large values are not
+            # decoded over and over
+            pending = len(self.buf) - self.pos
+            while self._more() and len(self.buf) - self.pos < 2 * pending:
+                pass
+
+
+def stream_array(chunks, key, members):
+    '''incrementally parse the JSON object in the byte chunks, yielding the
+    items of its `key` array one at a time and storing other top level
+    members in the `members` dict as they are read'''
+    stream = _JSONStream(chunks)
+    stream.expect('{')
+    while stream.peek() != '}':
+        if stream.peek() == ',':
+            stream.expect(',')
+        name = stream.value()
+        stream.expect(':')
+        if name != key:
+            members[name] = stream.value()
+            continue
+        stream.expect('[')
+        while stream.peek() != ']':
+            if stream.peek() == ',':
+                stream.expect(',')
+            yield stream.value()
+        stream.expect(']')
+
+
+def write_to_file(directory=None, callback=None, skip_unchanged=False,
+                  checksums=None):
     def writer(body):
         file = os.path.join(directory, body.name) if directory else None
-        body.write(file, callback)
+        body.write(file, callback, skip_unchanged, checksums)
     return writer
 
 
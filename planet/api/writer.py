@@ -0,0 +1,178 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+class WriterPool(object):
+    '''Threads writing bodies to disk, so the threads reading responses go
+    on reading while a slow disk catches up. Chunks wait in a buffer of
+    bounded size between the two, each file's in order on one writer.
+
+    :param writers: threads writing to disk
+    :param buffer_size: most bytes waiting to be written, across all files
+    :param chunk_size: bytes read from a response at a time
+    '''
+
+    def __init__(self, writers=2, buffer_size=16 * 1024 * 1024,
+                 chunk_size=256 * 1024):
+        self.buffer_size = buffer_size
+        self.chunk_size = chunk_size
+        self.queued = 0
+        self.max_queued = 0
+        self.bytes = 0
+        # seconds readers waited for buffer space and writers for chunks
+        self.read_blocked = 0.
+        self.write_blocked = 0.
+        self._space = threading.Condition()
+        self._queues = [Queue() for _ in range(writers)]
+        self._next = itertools.cycle(self._queues)
+        self._threads = []
+        for queue in self._queues:
+            thread = threading.Thread(target=self._run, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def open(self, path, mode='wb'):
+        '''open path for writing, the file returned queues its writes'''
+        with self._space:
+            queue = next(self._next)
+        return _PooledFile(self, open(path, mode), queue)
+
+    def close(self):
+        '''stop the writers once the chunks already queued are written'''
+        for queue in self._queues:
+            queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._space:
+            return {
+                'bytes': self.bytes,
+                'max_queued': self.max_queued,
+                'read_blocked': self.read_blocked,
+                'write_blocked': self.write_blocked
+            }
+
+    def _put(self, file, data, done=None, *args):
+        size = len(data)
+        with self._space:
+            # a chunk larger than the buffer is let through once it's empty
+            if self.queued and self.queued + size > self.buffer_size:
+                start = time.time()
+                while self.queued and self.queued + size > self.buffer_size:
+                    self._space.wait()
+                self.read_blocked += time.time() - start
+            self.queued += size
+            self.max_queued = max(self.max_queued, self.queued)
+            file.pending += size
+        file.queue.put((file, data, done, args))
+
+    def _run(self, queue):
+        while True:
+            start = time.time()
+            item = queue.get()
+            waited = time.time() - start
+            if item is None:
+                return
+            file, data, done, args = item
+            # not counting time idle before the file was opened
+            waited = min(waited, time.time() - file.opened)
+            if file.error is None:
+                try:
+                    file.fp.write(data)
+                except Exception as ex:
+                    file.error = ex
+            if done:
+                done(*args)
+            with self._space:
+                self.write_blocked += waited
+                self.queued -= len(data)
+                self.bytes += len(data)
+                file.pending -= len(data)
+                self._space.notify_all()
+
+    def _flush(self, file):
+        with self._space:
+            while file.pending:
+                self._space.wait()
+
+
+class _PooledFile(object):
+    '''a file written by a writer of the pool, any other operation waits for
+    queued writes first. Errors writing are raised by the next call.'''
+
+    def __init__(self, pool, fp, queue):
+        self.pool = pool
+        self.fp = fp
+        self.queue = queue
+        self.pending = 0
+        self.error = None
+        self.opened = time.time()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self._check()
+        self.pool._put(self, data)
+
+    def write_buffer(self, data, done, *args):
+        '''write data, a view of a buffer, then call done with args so the
+        buffer can be reused'''
+        try:
+            self._check()
+        except Exception:
+            done(*args)
+            raise
+        self.pool._put(self, data, done, *args)
+
+    def flush(self):
+        self.pool._flush(self)
+        self._check()
+        self.fp.flush()
+
+    def seek(self, offset, whence=0):
+        self.flush()
+        return self.fp.seek(offset, whence)
+
+    def tell(self):
+        self.flush()
+        return self.fp.tell()
+
+    def truncate(self, *size):
+        self.flush()
+        return self.fp.truncate(*size)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
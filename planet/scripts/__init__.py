@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import os
 import sys
 import time
 import json
@@ -24,19 +26,35 @@ import click
 import planet
 from planet import api
 
-from requests.packages.urllib3 import exceptions as urllib3exc
-
 client_params = {}
+_clients = []
 
 
 def client():
-    return api.Client(**client_params)
+    '''the client shared by everything done in one invocation'''
+    if not _clients:
+        params = dict(client_params)
+        warm = params.pop('warm', False)
+        _clients.append(api.Client(**params))
+        if warm:
+            _clients[0].warm()
+    return _clients[0]
 
 
 pretty = click.option('-pp', '--pretty', default=False, is_flag=True)
 scene_type = click.option('-s', '--scene-type', default='ortho')
 dest_dir = click.option('-d', '--dest', help='Destination directory',
                         type=click.Path(file_okay=False, resolve_path=True))
+skip_unchanged = click.option(
+    '--skip-unchanged', default=False, is_flag=True,
+    help='Keep existing files the server reports as unchanged'
+)
+checksum = click.option(
+    '--checksum', multiple=True, type=click.Choice(api.checksum.algorithms),
+    help=('Digest each file as it is written, checking it against any digest '
+          'the server sends, and write it to a file beside it such as '
+          'scene.tif.sha256. Repeat for several.')
+)
 
 
 # monkey patch warnings module to hide InsecurePlatformWarning - the warning
@@ -49,7 +67,8 @@ showwarning = warnings.showwarning
 
 
 def hack(message, category, filename, lineno):
-    if category is urllib3exc.InsecurePlatformWarning:
+    # compared by name to not import urllib3 before any request is made
+    if category.__name__ == 'InsecurePlatformWarning':
         if len(_insecure_warning) == 0:
             _insecure_warning.append(message)
         return
@@ -71,6 +90,12 @@ def click_exception(ex):
     raise click.ClickException(msg)
 
 
+def _ssl_error():
+    '''urllib3's SSLError, imported only once an exception is handled'''
+    from requests.packages.urllib3.exceptions import SSLError
+    return SSLError
+
+
 def call_and_wrap(func, *args, **kw):
     '''call the provided function and wrap any API exception with a click
     exception. this means no stack trace is visible to the user but instead
@@ -81,21 +106,63 @@ def call_and_wrap(func, *args, **kw):
         return func(*args, **kw)
     except api.exceptions.APIException as ex:
         click_exception(ex)
-    except urllib3exc.SSLError:
+    except _ssl_error():
         # see monkey patch above re InsecurePlatformWarning
         if _insecure_warning:
             click.echo(click.style(str(_insecure_warning[0]), fg='red'))
         raise
 
 
-def check_futures(futures):
-    for f in futures:
-        try:
-            f.await()
-        except api.InvalidAPIKey as invalid:
-            click_exception(invalid)
-        except api.APIException as other:
-            click.echo('WARNING %s' % other.message)
+def report_downloads(downloads):
+    '''report failed downloads as they complete, passing all of them on'''
+    for download in downloads:
+        if isinstance(download.error, api.InvalidAPIKey):
+            click_exception(download.error)
+        elif download.error:
+            click.echo('WARNING %s: %s' % (download.id, download.error))
+        yield download
+
+
+def save_checksums(downloads):
+    '''write the checksums of downloads to files beside them, in the
+    format `sha256sum -c` and similar tools check'''
+    for download in downloads:
+        for name, digest in sorted((download.checksums or {}).items()):
+            with open('%s.%s' % (download.path, name), 'w') as fp:
+                fp.write('%s  %s\n' % (digest, path.basename(download.path)))
+        yield download
+
+
+def check_downloads(downloads):
+    '''report failed downloads, returning the total bytes transferred'''
+    return sum(d.bytes for d in report_downloads(downloads))
+
+
+def read_scene_ids(src):
+    '''scene ids read a line at a time as they arrive on src, each line a
+    bare id or a GeoJSON feature as written by `search --all`'''
+    # readline rather than iterating, which reads ahead on python 2
+    for number, line in enumerate(iter(src.readline, ''), 1):
+        line = line.strip()
+        if line.startswith('{'):
+            try:
+                line = json.loads(line)['id']
+            except (ValueError, KeyError, TypeError):
+                raise click.ClickException(
+                    'line %d of input is not a scene id or feature with '
+                    'an id' % number)
+        if line:
+            yield line
+
+
+def report_writers(pool):
+    pool.close()
+    stats = pool.stats()
+    if stats['bytes']:
+        click.echo('reading waited %.2f seconds on writing, writing waited '
+                   '%.2f seconds on reading' % (stats['read_blocked'],
+                                                stats['write_blocked']),
+                   err=True)
 
 
 def summarize_throughput(bytes, start_time):
@@ -105,29 +172,63 @@ def summarize_throughput(bytes, start_time):
                (bytes, elapsed, mb/elapsed))
 
 
-def total_bytes(responses):
-    return sum([len(r.get_body()) for r in responses])
-
-
 @click.group()
 @click.option('-w', '--workers', default=4,
               help=('The number of concurrent downloads when requesting '
                     'multiple scenes.'))
+@click.option('--adaptive', default=False, is_flag=True,
+              help=('Adapt the number of concurrent requests to the server '
+                    'response, up to the number of workers.'))
+@click.option('--metrics', type=click.Path(dir_okay=False),
+              help=('Write request metrics in the Prometheus text format to '
+                    'this file on exit.'))
+@click.option('--events', type=click.File('a'),
+              help='Append an event per request as a line of JSON to a file.')
+@click.option('--warm', default=False, is_flag=True,
+              help=('Open a connection for each worker before making '
+                    'requests.'))
+@click.option('--writers', default=0,
+              help=('Threads writing downloads to disk, so the workers go on '
+                    'reading responses while the disk catches up. By '
+                    'default the workers write.'))
+@click.option('--write-buffer', default=16,
+              help='Megabytes of downloads waiting to be written at most.')
 @click.option('-v', '--verbose', count=True)
-@click.option('-k', '--api-key',
-              help='Valid API key - or via env variable %s' % api.auth.ENV_KEY)
+@click.option('-k', '--api-key', multiple=True,
+              help=('Valid API key - or via env variable %s. Repeat to '
+                    'spread requests over several keys.' % api.auth.ENV_KEY))
 @click.option('-u', '--base-url', help='Optional for testing')
 @click.version_option(version=planet.__version__, message='%(version)s')
-def cli(verbose, api_key, base_url, workers):
+@click.pass_context
+def cli(ctx, verbose, api_key, base_url, workers, adaptive, metrics, events,
+        warm, writers, write_buffer):
     '''Planet API Client'''
 
     configure_logging(verbose)
 
     client_params.clear()
-    client_params['api_key'] = api_key
+    del _clients[:]
+    client_params['api_key'] = list(api_key) if len(api_key) > 1 else (
+        api_key and api_key[0] or None)
     client_params['workers'] = workers
+    client_params['warm'] = warm
+    if adaptive:
+        client_params['limit'] = api.ConcurrencyLimit(1, workers)
     if base_url:
         client_params['base_url'] = base_url
+    hooks = []
+    if metrics:
+        registry = api.Metrics()
+        hooks.append(registry)
+        ctx.call_on_close(lambda: registry.write(metrics))
+    if events:
+        hooks.append(api.EventLog(events))
+    if hooks:
+        client_params['hooks'] = hooks
+    if writers:
+        pool = api.WriterPool(writers, write_buffer * 1024 * 1024)
+        client_params['writer'] = pool
+        ctx.call_on_close(lambda: report_writers(pool))
 
 
 @cli.command('help')
@@ -160,8 +261,17 @@ def list_scene_types():
               help=("Provide additional search criteria. See "
                     "https://www.planet.com/docs/v0/scenes/#metadata for "
                     " search metadata fields."))
-def get_scenes_list(scene_type, pretty, aoi, count, where):
+@click.option('--all', 'all_pages', default=False, is_flag=True,
+              help=('Write the scenes of every page as they arrive, one '
+                    'GeoJSON feature per line.'))
+@click.option('--limit', type=click.INT, required=False,
+              help='Like --all but stop after this many scenes.')
+def get_scenes_list(scene_type, pretty, aoi, count, where, all_pages, limit):
     '''Get a list of scenes'''
+    paged = all_pages or limit is not None
+    if paged and pretty:
+        raise click.UsageError('--pretty cannot be used with --all or '
+                               '--limit, which write one scene per line')
 
     if aoi == "-":
         src = click.open_file('-')
@@ -179,27 +289,69 @@ def get_scenes_list(scene_type, pretty, aoi, count, where):
     else:
         conditions = {}
 
-    res = call_and_wrap(client().get_scenes_list, scene_type=scene_type,
-                        intersects=aoi, count=count, **conditions).get_raw()
+    scenes = call_and_wrap(client().get_scenes_list, scene_type=scene_type,
+                           intersects=aoi, count=count, **conditions)
+    if paged:
+        call_and_wrap(echo_features, scenes, limit)
+        return
+    res = scenes.get_raw()
     if pretty:
         res = json.dumps(json.loads(res), indent=2)
     click.echo(res)
 
 
+def echo_features(scenes, limit=None):
+    '''write the features of the pages of scenes as lines of JSON while
+    each page is read, up to limit'''
+    written = 0
+    for page in scenes.iter(stream=True):
+        for feature in page.iter_features():
+            if limit is not None and written >= limit:
+                page.response.close()
+                return
+            click.echo(json.dumps(feature))
+            written += 1
+
+
 @pretty
 @scene_type
-@click.argument('scene_id', nargs=1)
+@click.argument('scene_ids', nargs=-1)
 @cli.command('metadata')
-def metadata(scene_id, scene_type, pretty):
-    '''Get scene metadata'''
+def metadata(scene_ids, scene_type, pretty):
+    '''Get scene metadata. Multiple scene ids, as arguments or one per line
+    on stdin, are fetched concurrently and written as one JSON document per
+    line, so cannot be pretty printed.'''
 
-    res = call_and_wrap(client().get_scene_metadata,
-                        scene_id, scene_type).get_raw()
+    if len(scene_ids) == 1:
+        res = call_and_wrap(client().get_scene_metadata,
+                            scene_ids[0], scene_type).get_raw()
+
+        if pretty:
+            res = json.dumps(json.loads(res), indent=2)
+
+        click.echo(res)
+        return
 
     if pretty:
-        res = json.dumps(json.loads(res), indent=2)
+        raise click.UsageError('--pretty requires a single scene id')
 
-    click.echo(res)
+    if len(scene_ids) == 0:
+        src = click.open_file('-')
+        if src.isatty():
+            raise click.UsageError('give scene ids as arguments or on stdin')
+        scene_ids = read_scene_ids(src)
+
+    def echo_results():
+        results = client().get_scenes_metadata(scene_ids, scene_type)
+        for scene_id, body, error in results:
+            if error:
+                if isinstance(error, api.InvalidAPIKey):
+                    click_exception(error)
+                click.echo('WARNING %s: %s' % (scene_id, error), err=True)
+            else:
+                click.echo(json.dumps(body.get()))
+
+    call_and_wrap(echo_results)
 
 
 @scene_type
@@ -210,9 +362,15 @@ def metadata(scene_id, scene_type, pretty):
                   ["band_%d" % i for i in range(1, 12)] +
                   ['visual', 'analytic', 'qa']
               ), default='visual')
+@click.option('--segments', default=1,
+              help=('The number of byte ranges to fetch each scene in '
+                    'concurrently, where supported.'))
+@skip_unchanged
+@checksum
 @cli.command('download')
 @click.pass_context
-def fetch_scene_geotiff(ctx, scene_ids, scene_type, product, dest):
+def fetch_scene_geotiff(ctx, scene_ids, scene_type, product, dest, segments,
+                        skip_unchanged, checksum):
     """
     Download full scene image(s).
     """
@@ -220,15 +378,17 @@ def fetch_scene_geotiff(ctx, scene_ids, scene_type, product, dest):
     if len(scene_ids) == 0:
         src = click.open_file('-')
         if not src.isatty():
-            scene_ids = map(lambda s: s.strip(), src.readlines())
+            scene_ids = read_scene_ids(src)
         else:
             click.echo(ctx.get_usage())
 
     start_time = time.time()
-    futures = client().fetch_scene_geotiffs(scene_ids, scene_type, product,
-                                            api.utils.write_to_file(dest))
-    check_futures(futures)
-    summarize_throughput(total_bytes(futures), start_time)
+    downloads = client().download_scene_geotiffs(
+        scene_ids, dest, scene_type, product, segments=segments,
+        skip_unchanged=skip_unchanged, checksums=checksum
+    )
+    summarize_throughput(check_downloads(save_checksums(downloads)),
+                         start_time)
 
 
 @scene_type
@@ -237,26 +397,36 @@ def fetch_scene_geotiff(ctx, scene_ids, scene_type, product, dest):
 @click.option('--size', type=click.Choice(['sm', 'md', 'lg']), default='md')
 @click.option('--format', 'fmt', type=click.Choice(['png', 'jpg', 'jpeg']),
               default='png')
+@skip_unchanged
+@checksum
 @cli.command('thumbnails')
-def fetch_scene_thumbnails(scene_ids, scene_type, size, fmt, dest):
+def fetch_scene_thumbnails(scene_ids, scene_type, size, fmt, dest,
+                           skip_unchanged, checksum):
     '''Fetch scene thumbnail(s)'''
 
     if len(scene_ids) == 0:
         src = click.open_file('-')
         if not src.isatty():
-            scene_ids = map(lambda s: s.strip(), src.readlines())
+            scene_ids = read_scene_ids(src)
 
-    futures = client().fetch_scene_thumbnails(scene_ids, scene_type, size, fmt,
-                                              api.write_to_file(dest))
-    check_futures(futures)
+    downloads = client().download_scene_thumbnails(
+        scene_ids, dest, scene_type, size, fmt, skip_unchanged=skip_unchanged,
+        checksums=checksum
+    )
+    check_downloads(save_checksums(downloads))
 
 
 @scene_type
 @click.argument("destination")
 @click.option("--limit", default=-1, help='limit scene syncing')
+@click.option('--checksum', multiple=True, default=['sha256'],
+              type=click.Choice(api.checksum.algorithms),
+              help=('Digest each scene as it is written and record it in '
+                    'the catalog, sha256 by default. Repeat for several.'))
 @cli.command('sync')
-def sync(destination, scene_type, limit):
+def sync(destination, scene_type, limit, checksum):
     '''Synchronize a directory to a specified AOI'''
+    from planet.api.catalog import Catalog
     if not path.exists(destination) or not path.isdir(destination):
         raise click.ClickException('destination must exist and be a directory')
     aoi_file = path.join(destination, 'aoi.geojson')
@@ -267,58 +437,96 @@ def sync(destination, scene_type, limit):
     aoi = None
     with open(aoi_file) as fp:
         aoi = fp.read()
+    catalog = Catalog(path.join(destination, 'catalog.db'))
+    latest = catalog.latest()
     sync_file = path.join(destination, 'sync.json')
-    if path.exists(sync_file):
+    if latest is None and path.exists(sync_file):
+        # destinations synced before the catalog existed
         with open(sync_file) as fp:
-            sync = json.loads(fp.read())
-    else:
-        sync = {}
+            latest = json.loads(fp.read()).get('latest')
     filters = {}
-    if 'latest' in sync:
-        filters['acquired.gt'] = sync['latest']
+    if latest:
+        filters['acquired.gt'] = latest
+    # scenes recorded by earlier runs that failed or were interrupted
+    retries = catalog.unfinished()
+    retried = set(retries)
     start_time = time.time()
-    transferred = 0
     _client = client()
     res = call_and_wrap(_client.get_scenes_list, scene_type=scene_type,
                         intersects=aoi, count=100, order_by='acquired asc',
                         **filters)
+    if retries:
+        click.echo('retrying unfinished scenes: %s' % len(retries))
     click.echo('total scenes to fetch: %s' % res.get()['count'])
     if limit > 0:
         click.echo('limiting to %s' % limit)
+    total = len(retries) + res.get()['count']
     counter = type('counter', (object,),
-                   {'remaining': res.get()['count'] if limit < 1 else limit})()
-    latest = None
+                   {'remaining': total if limit < 1 else limit})()
 
     def progress_callback(arg):
         if not isinstance(arg, int):
             counter.remaining -= 1
             click.echo('downloaded %s, remaining %s' %
                        (arg.name, counter.remaining))
-    write_callback = api.write_to_file(destination, progress_callback)
-    for page in res.iter():
-        features = page.get()['features'][:counter.remaining]
-        if not features:
-            break
-        ids = [f['id'] for f in features]
-        futures = _client.fetch_scene_geotiffs(
-            ids, scene_type, callback=write_callback
-        )
-        for f in features:
-            metadata = path.join(destination, '%s_metadata.json' % f['id'])
-            with open(metadata, 'wb') as fp:
-                fp.write(json.dumps(f, indent=2))
-        check_futures(futures)
-        transferred += total_bytes(futures)
-        recent = max([
-            api.strp_timestamp(f['properties']['acquired']) for f in features]
-        )
-        latest = max(latest, recent) if latest else recent
-        if counter.remaining <= 0:
-            break
-    if latest:
-        sync['latest'] = api.strf_timestamp(latest)
-        with open(sync_file, 'wb') as fp:
-            fp.write(json.dumps(sync, indent=2))
+
+    def scene_ids():
+        '''unfinished scenes, then those from pages fetched ahead in the
+        background, recorded in the catalog a page at a time'''
+        total = counter.remaining
+        for scene_id in retries[:total]:
+            yield scene_id
+        total -= len(retries)
+        for page in res.iter():
+            if total <= 0:
+                return
+            features = [f for f in page.get()['features']
+                        if f['id'] not in retried and
+                        catalog.status(f['id']) != Catalog.DONE][:total]
+            total -= len(features)
+            catalog.add(features)
+            for f in features:
+                yield f['id']
+
+    # names of the files present, to tell which scenes may be on disk
+    existing = sorted(os.listdir(destination))
+
+    def may_exist(scene_id):
+        '''whether a download might already be complete, worth checking
+        with a HEAD request before fetching again'''
+        if scene_id in retried:
+            return True
+        i = bisect.bisect_left(existing, scene_id)
+        while i < len(existing) and existing[i].startswith(scene_id):
+            if existing[i][len(scene_id):][:1] in ('.', '_'):
+                return True
+            i += 1
+        return False
+
+    transferred = 0
+    downloads = _client.download_scene_geotiffs(
+        scene_ids(), destination, scene_type, callback=progress_callback,
+        skip_unchanged=may_exist, checksums=checksum
+    )
+    try:
+        for download in report_downloads(downloads):
+            transferred += download.bytes
+            if download.error:
+                catalog.mark(download.id, Catalog.FAILED)
+            else:
+                # the size on disk, which a skipped download did not send
+                size = None
+                if download.path and path.exists(download.path):
+                    size = path.getsize(download.path)
+                # a skipped download keeps the checksum recorded before
+                digests = download.checksums and api.checksum.format_checksums(
+                    download.checksums)
+                catalog.mark(download.id, Catalog.DONE, download.path, size,
+                             digests)
+    except api.APIException as ex:
+        click_exception(ex)
+    finally:
+        catalog.close()
     if transferred:
         summarize_throughput(transferred, start_time)
 
@@ -70,6 +70,7 @@ setup(name='planet',
           'requests_futures>=0.9.5'
       ],
       extras_require={
+          'async': ['aiohttp'],
           'test': test_requires,
           'dev': test_requires + [
               'pex',
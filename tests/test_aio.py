@@ -0,0 +1,111 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test the asyncio client against a local aiohttp server, skipped where
+aiohttp (and so Python 3) is not available'''
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import asyncio  # noqa
+from aiohttp import web  # noqa
+from planet import api  # noqa
+from planet.api import aio  # noqa
+
+
+@asyncio.coroutine
+def page(request):
+    start = int(request.query.get('start', 0))
+    links = {}
+    if start < 2:
+        links['next'] = str(request.url.with_query(start=start + 1))
+    return web.json_response({
+        'count': 3, 'links': links, 'features': [{'id': 'x%s' % start}]
+    })
+
+
+@asyncio.coroutine
+def metadata(request):
+    if request.match_info['id'] == 'missing':
+        return web.Response(status=404, text='no such scene')
+    assert request.headers['Authorization'] == 'api-key foobar'
+    return web.json_response({'id': request.match_info['id']})
+
+
+@asyncio.coroutine
+def full(request):
+    return web.Response(body=b'0123456789', headers={
+        'content-disposition': 'filename="%s.tif"' % request.match_info['id']
+    })
+
+
+@pytest.fixture()
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture()
+def client(loop):
+    app = web.Application(loop=loop)
+    app.router.add_get('/scenes/ortho', page)
+    app.router.add_get('/scenes/ortho/{id}', metadata)
+    app.router.add_get('/scenes/ortho/{id}/full', full)
+    handler = app.make_handler(loop=loop)
+    server = loop.run_until_complete(
+        loop.create_server(handler, '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+    client = aio.AsyncClient('foobar', 'http://127.0.0.1:%s/' % port,
+                             loop=loop)
+    yield client
+    loop.run_until_complete(client.close())
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.run_until_complete(app.shutdown())
+    loop.run_until_complete(handler.shutdown(1))
+    loop.run_until_complete(app.cleanup())
+
+
+def test_get_scene_metadata(client, loop):
+    body = loop.run_until_complete(client.get_scene_metadata('x22'))
+    assert loop.run_until_complete(body.get()) == {'id': 'x22'}
+
+
+def test_status_code_404(client, loop):
+    with pytest.raises(api.exceptions.MissingResource) as ex:
+        loop.run_until_complete(client.get_scene_metadata('missing'))
+    assert str(ex.value) == 'no such scene'
+
+
+def test_scene_pages(client, loop):
+    pages = loop.run_until_complete(client.get_scenes_list()).iter()
+    ids = []
+    while True:
+        scenes = loop.run_until_complete(pages.next())
+        if scenes is None:
+            break
+        ids.extend(f['id'] for f in loop.run_until_complete(scenes.get())
+                   ['features'])
+    assert ids == ['x0', 'x1', 'x2']
+
+
+def test_fetch_scene_geotiffs(client, loop, tmpdir):
+    bodies = loop.run_until_complete(client.fetch_scene_geotiffs(
+        ['a', 'b'], callback=aio.write_to_file(str(tmpdir))))
+    assert [len(b) for b in bodies] == [10, 10]
+    assert tmpdir.join('a.tif').read() == '0123456789'
+    assert tmpdir.join('b.tif').read() == '0123456789'
+    assert sorted(f.basename for f in tmpdir.listdir()) == ['a.tif', 'b.tif']
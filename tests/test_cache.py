@@ -0,0 +1,174 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+
+from planet import api
+import pytest
+import requests_mock
+
+
+@pytest.fixture()
+def cache(tmpdir):
+    return api.DiskCache(str(tmpdir.join('cache')))
+
+
+@pytest.fixture()
+def client(cache):
+    return api.Client('foobar', cache=cache)
+
+
+def test_cache_hit(client, cache):
+    '''Verify fresh entries are served without a request'''
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, json={'id': 'x22'})
+        assert client.get_scene_metadata('x22').get() == {'id': 'x22'}
+        assert client.get_scene_metadata('x22').get() == {'id': 'x22'}
+        assert m.call_count == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cache_persists(client, cache):
+    '''Verify entries are read back by a new cache on the same directory'''
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'mosaics')
+        m.get(uri, json={'mosaics': []})
+        client.list_mosaics()
+        other = api.Client('foobar', cache=api.DiskCache(cache.directory))
+        assert other.list_mosaics().get() == {'mosaics': []}
+        assert m.call_count == 1
+
+
+def test_cache_bulk_metadata(client, cache):
+    '''Verify bulk metadata is served from the cache where fresh'''
+    with requests_mock.Mocker() as m:
+        for sid in ('a', 'b'):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s' % sid)
+            m.get(uri, json={'id': sid})
+        client.get_scene_metadata('a')
+        results = list(client.get_scenes_metadata(['a', 'b'], ordered=True))
+        assert m.call_count == 2
+    assert [(r[0], r[1].get()) for r in results] == [
+        ('a', {'id': 'a'}), ('b', {'id': 'b'})]
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+
+def test_cache_revalidate(client, cache):
+    '''Verify stale entries are revalidated with the stored ETag'''
+    cache.ttl = 0
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, json={'id': 'x22'}, headers={'ETag': '"v1"'})
+        m.get(uri, status_code=304, request_headers={'If-None-Match': '"v1"'})
+        client.get_scene_metadata('x22')
+        assert client.get_scene_metadata('x22').get() == {'id': 'x22'}
+        assert m.call_count == 2
+    assert cache.stats()['revalidated'] == 1
+
+
+def test_cache_eviction(client, cache):
+    '''Verify least recently used entries are evicted past max_size'''
+    with requests_mock.Mocker() as m:
+        for sid in ('a', 'b', 'c'):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s' % sid)
+            m.get(uri, text='x' * 10)
+        cache.max_size = 25
+        for sid in ('a', 'b', 'a', 'c'):
+            client.get_scene_metadata(sid)
+        assert cache.stats()['entries'] == 2
+        assert cache.size == 20
+        client.get_scene_metadata('a')
+        assert cache.hits == 2
+        client.get_scene_metadata('b')
+        assert cache.misses == 4
+
+
+def test_thumbnail_cache(tmpdir):
+    '''Verify thumbnails are served from memory, spilled and read back'''
+    thumbnails = api.ThumbnailCache(max_size=20, spill=str(tmpdir))
+    client = api.Client('foobar', thumbnails=thumbnails)
+    with requests_mock.Mocker() as m:
+        for sid in ('a', 'b'):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s/thumb' % sid)
+            m.get(uri, content=sid.encode('ascii') * 10)
+        assert client.get_scene_thumbnail('a') == b'a' * 10
+        assert client.get_scene_thumbnail('a') == b'a' * 10
+        assert m.call_count == 1
+        # a larger size is another thumbnail
+        client.get_scene_thumbnail('a', size='lg')
+        assert m.call_count == 2
+        # b evicts the least recent, the md thumbnail of a, to disk
+        client.get_scene_thumbnail('b')
+        assert ('ortho', 'a', 'md', 'png') in thumbnails
+        assert client.get_scene_thumbnail('a') == b'a' * 10
+        assert m.call_count == 3
+    stats = thumbnails.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 3
+    assert stats['spill_hits'] == 1
+    assert stats['hit_bytes'] == 10
+    assert stats['miss_bytes'] == 30
+    assert stats['size'] == 20
+    assert stats['entries'] == 2
+    assert stats['evicted_bytes'] == 20
+
+    # too large to hold in memory, straight to disk
+    thumbnails.get(('ortho', 'c', 'lg', 'png'), lambda: b'c' * 30)
+    stats = thumbnails.stats()
+    assert stats['entries'] == 2
+    assert stats['evicted_bytes'] == 50
+    assert ('ortho', 'c', 'lg', 'png') in thumbnails
+
+
+def test_get_scene_thumbnails():
+    '''Verify cached thumbnails are not requested and failures reported'''
+    client = api.Client('foobar')
+    with requests_mock.Mocker() as m:
+        for sid, status in (('a', 200), ('b', 200), ('c', 404)):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s/thumb' % sid)
+            m.get(uri, content=sid.encode('ascii'), status_code=status)
+        client.get_scene_thumbnail('a')
+        results = list(client.get_scene_thumbnails('abc', ordered=True))
+        assert m.call_count == 3
+    assert [r[:2] for r in results] == [('a', b'a'), ('b', b'b'), ('c', None)]
+    assert isinstance(results[2][2], api.MissingResource)
+
+
+def test_thumbnail_cache_loads_once():
+    '''Verify threads asking for a thumbnail being loaded wait for it'''
+    thumbnails = api.ThumbnailCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(.1)
+        return b'png'
+
+    key = ('ortho', 'a', 'md', 'png')
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(thumbnails.get(key, load)))
+        for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b'png'] * 4
+    assert len(loads) == 1
+    assert thumbnails.stats()['hits'] == 3
@@ -0,0 +1,50 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from planet.api.catalog import Catalog
+
+
+def _feature(sid, acquired, **props):
+    props['acquired'] = acquired
+    return {'id': sid, 'properties': props}
+
+
+def test_add_keeps_status(tmpdir):
+    catalog = Catalog(str(tmpdir.join('catalog.db')))
+    catalog.add([_feature('a', '2015-01-01'), _feature('b', '2015-01-02')])
+    assert catalog.status('a') == Catalog.PENDING
+    assert catalog.status('x') is None
+    catalog.mark('a', Catalog.DONE, '/tmp/a.tif', 10)
+    catalog.mark('b', Catalog.FAILED)
+
+    # metadata is refreshed, download state is not
+    catalog.add([_feature('a', '2015-01-01', cloud=5)])
+    assert catalog.status('a') == Catalog.DONE
+    assert catalog.metadata('a')['properties']['cloud'] == 5
+    assert catalog.unfinished() == ['b']
+    assert catalog.latest() == '2015-01-02'
+    catalog.close()
+
+
+def test_persists(tmpdir):
+    path = str(tmpdir.join('catalog.db'))
+    catalog = Catalog(path)
+    catalog.add([_feature('b', '2015-01-02'), _feature('a', '2015-01-01')])
+    catalog.mark('b', Catalog.DONE, bytes=10)
+    catalog.close()
+
+    catalog = Catalog(path)
+    assert catalog.counts() == {'done': 1, 'pending': 1}
+    assert catalog.unfinished() == ['a']
+    catalog.close()
@@ -0,0 +1,73 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+
+from planet.api import checksum
+from planet.api.exceptions import ChecksumMismatch
+import pytest
+
+_content = b'0123456789'
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode('ascii')
+
+
+def test_digests(tmpdir):
+    digests = checksum.Digests(['md5', 'sha256'])
+    digests.update(_content[:4])
+    digests.update(_content[4:])
+    assert digests.hexdigests() == {
+        'md5': hashlib.md5(_content).hexdigest(),
+        'sha256': hashlib.sha256(_content).hexdigest()
+    }
+    path = tmpdir.join('partial')
+    path.write(_content, 'wb')
+    digests.reset()
+    digests.update_file(str(path), 4, chunk_size=3)
+    assert digests.digests()['md5'] == hashlib.md5(_content[:4]).digest()
+    with pytest.raises(ValueError):
+        checksum.Digests(['md4'])
+
+
+def test_server_digests():
+    md5 = hashlib.md5(_content).digest()
+    sha256 = hashlib.sha256(_content).digest()
+    headers = {'digest': 'MD5=%s, SHA-256=%s, unixsum=30' % (
+        _b64(md5), _b64(sha256))}
+    assert checksum.server_digests(headers) == {'md5': md5,
+                                                'sha256': sha256}
+    headers = {'x-goog-hash': 'crc32c=n03x6A==, md5=%s' % _b64(md5)}
+    assert checksum.server_digests(headers)['md5'] == md5
+    assert checksum.server_digests({'content-md5': _b64(md5)}) == {
+        'md5': md5}
+    assert checksum.server_digests({'content-md5': '!'}) == {}
+
+
+def test_verify():
+    digests = checksum.Digests(['md5'])
+    digests.update(_content)
+    md5 = hashlib.md5(_content).digest()
+    digests.verify({'content-md5': _b64(md5)})
+    # algorithms not computed are not compared
+    digests.verify({'digest': 'sha-256=%s' % _b64(b'x' * 32)})
+    with pytest.raises(ChecksumMismatch):
+        digests.verify({'content-md5': _b64(b'x' * 16)})
+
+
+def test_format_checksums():
+    assert checksum.format_checksums({'sha256': 'ab', 'md5': 'cd'}) == \
+        'md5:cd sha256:ab'
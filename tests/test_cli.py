@@ -21,6 +21,8 @@ lower level lib/client tests go in the test_mod suite
 
 import os
 import json
+import subprocess
+import sys
 
 from click import ClickException
 from click.testing import CliRunner
@@ -30,6 +32,7 @@ from mock import MagicMock
 import planet
 from planet import api
 from planet.api import models
+from planet.api.catalog import Catalog
 from planet import scripts
 
 
@@ -79,6 +82,8 @@ def test_api_key_flag():
     runner.invoke(scripts.cli, ['-k', 'shazbot', 'list-scene-types'])
     assert 'api_key' in scripts.client_params
     assert scripts.client_params['api_key'] == 'shazbot'
+    runner.invoke(scripts.cli, ['-k', 'a', '-k', 'b', 'list-scene-types'])
+    assert scripts.client_params['api_key'] == ['a', 'b']
 
 
 def test_search():
@@ -118,6 +123,42 @@ def test_search_by_aoi():
     assert_success(result, expected)
 
 
+def test_search_all():
+
+    pages = []
+    for ids in (['a', 'b'], ['c']):
+        page = MagicMock(spec=models.Scenes)
+        page.iter_features.return_value = iter([{'id': i} for i in ids])
+        page.response = MagicMock()
+        pages.append(page)
+    scenes = MagicMock(spec=models.Scenes)
+    scenes.iter.return_value = iter(pages)
+    client.get_scenes_list.return_value = scenes
+
+    result = runner.invoke(scripts.cli, ['search', '--all'])
+
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [
+        {'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+    assert scenes.iter.call_args[1] == {'stream': True}
+
+    # a limit stops within a page without reading the rest
+    for page, ids in zip(pages, (['a', 'b'], ['c'])):
+        page.reset_mock()
+        page.iter_features.return_value = iter([{'id': i} for i in ids])
+    scenes.iter.return_value = iter(pages)
+
+    result = runner.invoke(scripts.cli, ['search', '--limit', '1'])
+
+    assert result.exit_code == 0
+    assert result.output == '{"id": "a"}\n'
+    assert pages[0].response.close.called
+    assert not pages[1].iter_features.called
+
+    result = runner.invoke(scripts.cli, ['search', '--all', '--pretty'])
+    assert result.exit_code == 2
+
+
 def test_metadata():
 
     # Read in fixture
@@ -141,3 +182,249 @@ def test_download():
 
     result = runner.invoke(scripts.cli, ['download', '20150615_190229_0905'])
     assert result.exit_code == 0
+
+
+def test_download_segments():
+
+    result = runner.invoke(scripts.cli, ['download', '--segments', '4',
+                                         '20150615_190229_0905'])
+    assert result.exit_code == 0
+    args, kw = client.download_scene_geotiffs.call_args
+    assert kw['segments'] == 4
+
+
+def test_download_stdin():
+
+    received = []
+
+    def download(scene_ids, *args, **kw):
+        for sid in scene_ids:
+            received.append(sid)
+            yield models.Download(sid, None, 1, .1, None)
+    client.download_scene_geotiffs.side_effect = download
+
+    lines = ['a', '', json.dumps({'type': 'Feature', 'id': 'b'}), ' c ']
+    result = runner.invoke(scripts.cli, ['download'],
+                           input='\n'.join(lines) + '\n')
+
+    client.download_scene_geotiffs.side_effect = None
+    assert result.exit_code == 0
+    assert received == ['a', 'b', 'c']
+
+
+def test_read_scene_ids_lazily():
+
+    lines = ['a\n', '{"id": "b"}\n', '']
+    src = MagicMock()
+    src.readline.side_effect = lambda: lines.pop(0)
+
+    ids = scripts.read_scene_ids(src)
+
+    # an id is passed on as soon as its line is read
+    assert next(ids) == 'a'
+    assert lines == ['{"id": "b"}\n', '']
+    assert list(ids) == ['b']
+
+    for bad in ('{"id": ', '{"type": "Feature"}'):
+        src = MagicMock()
+        src.readline.side_effect = ['a\n', bad + '\n', '']
+        ids = scripts.read_scene_ids(src)
+        assert next(ids) == 'a'
+        try:
+            next(ids)
+            assert False, 'did not throw'
+        except ClickException as ex:
+            assert 'line 2 of input' in str(ex)
+
+
+def test_metadata_many():
+
+    body = MagicMock(spec=models.JSON)
+    body.get.return_value = {'id': 'a'}
+    missing = api.exceptions.MissingResource('no such scene')
+    client.get_scenes_metadata.return_value = iter([
+        ('a', body, None), ('b', None, missing)
+    ])
+
+    result = runner.invoke(scripts.cli, ['metadata'], input='a\nb\n')
+
+    assert result.exit_code == 0
+    assert json.loads(result.output.splitlines()[0]) == {'id': 'a'}
+    assert 'WARNING b: no such scene' in result.output
+    args, kw = client.get_scenes_metadata.call_args
+    assert list(args[0]) == ['a', 'b']
+
+    result = runner.invoke(scripts.cli, ['metadata', '-pp', 'a', 'b'])
+    assert result.exit_code == 2
+    assert '--pretty requires a single scene id' in result.output
+
+    def no_key(scene_ids, scene_type):
+        raise api.InvalidAPIKey('No API key provided')
+        yield
+    client.get_scenes_metadata.side_effect = no_key
+    result = runner.invoke(scripts.cli, ['metadata', 'a', 'b'])
+    client.get_scenes_metadata.side_effect = None
+    assert result.exit_code == 1
+    assert 'InvalidAPIKey: No API key provided' in result.output
+
+
+def test_metadata_terminal(monkeypatch):
+    '''Verify metadata without ids does not wait on a terminal'''
+    terminal = MagicMock()
+    terminal.isatty.return_value = True
+    monkeypatch.setattr(scripts.click, 'open_file', lambda name: terminal)
+    result = runner.invoke(scripts.cli, ['metadata'])
+    assert result.exit_code == 2
+    assert 'give scene ids as arguments or on stdin' in result.output
+    assert not terminal.readline.called
+
+
+def test_adaptive_flag():
+    runner.invoke(scripts.cli, ['-w', '12', '--adaptive',
+                                'list-scene-types'])
+    limit = scripts.client_params['limit']
+    assert (limit.floor, limit.ceiling) == (1, 12)
+
+
+def test_metrics_options(tmpdir):
+    prom = tmpdir.join('planet.prom')
+    client.download_scene_geotiffs.return_value = iter([])
+    result = runner.invoke(scripts.cli, [
+        '--metrics', str(prom), '--events', str(tmpdir.join('events.json')),
+        'download', 'a'])
+    assert result.exit_code == 0
+    hooks = scripts.client_params['hooks']
+    assert [type(h) for h in hooks] == [api.Metrics, api.EventLog]
+    assert 'planet_requests_total' in prom.read()
+
+
+def test_writers_option():
+    client.download_scene_geotiffs.return_value = iter([])
+    result = runner.invoke(scripts.cli, [
+        '--writers', '2', '--write-buffer', '4', 'download', 'a'])
+    assert result.exit_code == 0
+    pool = scripts.client_params['writer']
+    assert pool.buffer_size == 4 * 1024 * 1024
+    assert not any(t.is_alive() for t in pool._threads)
+
+
+def test_download_checksum(tmpdir):
+
+    tif = tmpdir.join('a.tif')
+    tif.write('0123')
+    client.download_scene_geotiffs.return_value = iter([
+        models.Download('a', str(tif), 4, .1, None, {'sha256': 'ab01'})
+    ])
+
+    result = runner.invoke(scripts.cli, ['download', '--checksum', 'sha256',
+                                         'a'])
+
+    assert result.exit_code == 0
+    args, kw = client.download_scene_geotiffs.call_args
+    assert kw['checksums'] == ('sha256',)
+    assert tmpdir.join('a.tif.sha256').read() == 'ab01  a.tif\n'
+
+
+def test_download_reports_failures():
+
+    client.download_scene_geotiffs.return_value = iter([
+        models.Download('a', '/tmp/a.tif', 10, .1, None),
+        models.Download('b', None, 0, .1,
+                        api.exceptions.MissingResource('no such scene')),
+    ])
+
+    result = runner.invoke(scripts.cli, ['download', 'a', 'b'])
+
+    assert result.exit_code == 0
+    assert 'WARNING b: no such scene' in result.output
+    assert 'transferred 10 bytes' in result.output
+
+
+def _feature(sid, acquired):
+    return {'id': sid, 'properties': {'acquired': acquired}}
+
+
+def test_sync(tmpdir):
+
+    tmpdir.join('aoi.geojson').write('{}')
+    pages = [
+        {'count': 4, 'features': [
+            _feature('a', '2015-01-01T00:00:00.000000+00:00'),
+            _feature('b', '2015-01-02T00:00:00.000000+00:00')]},
+        {'count': 4, 'features': [
+            _feature('c', '2015-01-03T00:00:00.000000+00:00'),
+            _feature('d', '2015-01-04T00:00:00.000000+00:00')]}
+    ]
+    scenes = MagicMock(spec=models.Scenes)
+    scenes.get.return_value = pages[0]
+    page_bodies = []
+    for page in pages:
+        body = MagicMock(spec=models.Scenes)
+        body.get.return_value = page
+        page_bodies.append(body)
+    scenes.iter.return_value = iter(page_bodies)
+    client.get_scenes_list.return_value = scenes
+
+    # b is already on disk
+    tmpdir.join('b_visual.tif').write('0123')
+    checked = []
+
+    def download(scene_ids, *args, **kw):
+        for sid in scene_ids:
+            if kw['skip_unchanged'](sid):
+                checked.append(sid)
+                path = str(tmpdir.join('%s_visual.tif' % sid))
+                yield models.Download(sid, path, 0, .1, None)
+                continue
+            error = api.exceptions.ServerError('oops') if sid == 'c' else None
+            yield models.Download(sid, None, 0 if error else 10, .1, error,
+                                  None if error else {'sha256': sid * 4})
+    client.download_scene_geotiffs.side_effect = download
+
+    result = runner.invoke(scripts.cli, ['sync', str(tmpdir)])
+
+    assert result.exit_code == 0
+    assert 'WARNING c: oops' in result.output
+    # only scenes that may be on disk are checked before downloading
+    assert checked == ['b']
+    catalog = Catalog(str(tmpdir.join('catalog.db')))
+    assert catalog.metadata('d') == pages[1]['features'][1]
+    size = catalog.db.execute('select bytes from scenes where id = ?', 'b')
+    assert size.fetchone()[0] == 4
+    digest = catalog.db.execute('select checksum from scenes where id = ?',
+                                'a')
+    assert digest.fetchone()[0] == 'sha256:aaaa'
+    assert client.download_scene_geotiffs.call_args[1]['checksums'] == \
+        ('sha256',)
+    assert catalog.counts() == {'done': 3, 'failed': 1}
+    assert catalog.latest() == '2015-01-04T00:00:00.000000+00:00'
+    catalog.close()
+
+    # the next run retries the failed scene and skips the finished ones
+    scenes.get.return_value = {'count': 1, 'features': []}
+    body = MagicMock(spec=models.Scenes)
+    body.get.return_value = {'count': 1, 'features': [
+        _feature('d', '2015-01-04T00:00:00.000000+00:00')]}
+    scenes.iter.return_value = iter([body])
+    del checked[:]
+
+    result = runner.invoke(scripts.cli, ['sync', str(tmpdir)])
+
+    client.download_scene_geotiffs.side_effect = None
+    assert result.exit_code == 0
+    assert 'retrying unfinished scenes: 1' in result.output
+    assert checked == ['c']
+    filters = client.get_scenes_list.call_args[1]
+    assert filters['acquired.gt'] == '2015-01-04T00:00:00.000000+00:00'
+    catalog = Catalog(str(tmpdir.join('catalog.db')))
+    assert catalog.counts() == {'done': 4}
+    catalog.close()
+
+
+def test_startup_imports_no_transport():
+    # commands that make no request shouldn't pay for importing requests
+    code = ('import sys, planet.scripts; '
+            'print([m for m in ("requests", "sqlite3", "planet.api.client") '
+            'if m in sys.modules])')
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.strip() == b'[]'
@@ -0,0 +1,73 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+
+from planet.api.metrics import EventLog
+from planet.api.metrics import Metrics
+
+
+def _request(status=200, error=None, attempt=0, ttfb=.2):
+    return {'event': 'request', 'url': 'http://x', 'method': 'GET',
+            'status': status, 'error': error, 'attempt': attempt,
+            'ttfb': ttfb, 'queue_wait': .01, 'in_flight': 2}
+
+
+def test_metrics():
+    metrics = Metrics()
+    metrics(_request(503))
+    metrics(_request(200, attempt=1, ttfb=3))
+    metrics(_request(None, 'ConnectionError'))
+    metrics({'event': 'body', 'url': 'http://x', 'bytes': 10,
+             'duration': 1.5})
+    metrics({'event': 'coalesced', 'url': 'http://x', 'method': 'GET'})
+    assert metrics.stats() == {
+        'requests': 2,
+        'statuses': {200: 1, 503: 1},
+        'errors': {'ConnectionError': 1},
+        'retries': 1,
+        'coalesced': 1,
+        'bytes': 10,
+        'max_in_flight': 2
+    }
+    text = metrics.prometheus()
+    assert '# TYPE planet_requests_total counter' in text
+    assert 'planet_requests_total{status="503"} 1' in text
+    assert 'planet_request_errors_total{error="ConnectionError"} 1' in text
+    assert 'planet_request_ttfb_seconds_bucket{le="0.25"} 1' in text
+    assert 'planet_request_ttfb_seconds_bucket{le="5"} 2' in text
+    assert 'planet_request_ttfb_seconds_bucket{le="+Inf"} 2' in text
+    assert 'planet_request_ttfb_seconds_count 2' in text
+    assert 'planet_body_bytes_total 10' in text
+    assert 'planet_requests_coalesced_total 1' in text
+
+
+def test_metrics_write(tmpdir):
+    metrics = Metrics(prefix='ingest')
+    path = str(tmpdir.join('planet.prom'))
+    metrics.write(path)
+    assert 'ingest_request_retries_total 0' in open(path).read()
+    assert tmpdir.listdir() == [tmpdir.join('planet.prom')]
+
+
+def test_event_log():
+    out = io.StringIO() if str is not bytes else io.BytesIO()
+    log = EventLog(out)
+    log(_request())
+    log({'event': 'body', 'url': 'http://x', 'bytes': 10, 'duration': 1})
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [e['event'] for e in lines] == ['request', 'body']
+    assert lines[0]['status'] == 200
+    assert 'time' in lines[1]
@@ -17,20 +17,33 @@ a request is made to the expected URL and the response is as provided. Unless
 specifically needed (e.g., JSON format), the response content should not
 matter'''
 
+import base64
+import hashlib
+import io
+import json
 import os
+import socket
+import sys
+import threading
+import time
 
 from planet import api
+from planet.api import models
 import pytest
+import requests
 import requests_mock
 
 # have to clear in case key is picked up via env
 if api.auth.ENV_KEY in os.environ:
     os.environ.pop(api.auth.ENV_KEY)
 
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURE_DIR = os.path.join(TEST_DIR, 'fixtures')
+
 
 @pytest.fixture()
 def client():
-    return api.Client('foobar')
+    return api.Client('foobar', retry=api.RetryPolicy(backoff=0))
 
 
 def test_assert_client_execution_success(client):
@@ -85,3 +98,566 @@ def test_fetch_scene_info_scene_id(client):
         uri = os.path.join(client.base_url, 'scenes/ortho/x22')
         m.get(uri, text='bananas', status_code=200)
         client.get_scene_metadata('x22').get_raw() == 'bananas'
+
+
+def test_write_resumes_partial_file(client, tmpdir):
+    '''Verify an existing partial file is resumed with a range request'''
+    dest = str(tmpdir.join('scene.tif'))
+    tmpdir.join('scene.tif.part').write('0123')
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, text='0123456789', headers={'content-length': '10'})
+        m.get(uri, text='456789', status_code=206,
+              request_headers={'Range': 'bytes=4-'},
+              headers={'content-range': 'bytes 4-9/10'})
+        client._get('scenes/ortho/x22/full').get_body().write(dest)
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+    assert not tmpdir.join('scene.tif.part').exists()
+
+
+def test_write_resumes_redirect_without_auth(client, tmpdir):
+    '''Verify a resumed redirected body sends no API key to the host it
+    was redirected to'''
+    dest = str(tmpdir.join('scene.tif'))
+    tmpdir.join('scene.tif.part').write('0123')
+    storage = 'https://storage.example.com/x22.tif'
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, status_code=302, headers={'location': storage})
+        m.get(storage, text='0123456789', headers={'content-length': '10'})
+        m.get(storage, text='456789', status_code=206,
+              request_headers={'Range': 'bytes=4-'},
+              headers={'content-range': 'bytes 4-9/10'})
+        client._get('scenes/ortho/x22/full').get_body().write(dest)
+        sent = [r for r in m.request_history if r.url == storage]
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+    assert len(sent) == 2
+    assert [r.headers.get('Authorization') for r in sent] == [None, None]
+
+
+def test_write_restarts_when_range_ignored(client, tmpdir):
+    '''Verify a partial file is rewritten if the server ignores the range'''
+    dest = str(tmpdir.join('scene.tif'))
+    tmpdir.join('scene.tif.part').write('xxxx')
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, text='0123456789')
+        client._get('scenes/ortho/x22/full').get_body().write(dest)
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+
+
+class _DroppingStream(io.BytesIO):
+    '''stream that fails with a socket error after limit bytes'''
+
+    def __init__(self, content, limit):
+        io.BytesIO.__init__(self, content)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise socket.error('connection reset')
+        return io.BytesIO.read(self, min(size, self.limit - self.tell()))
+
+    def readinto(self, buffer):
+        if self.tell() >= self.limit:
+            raise socket.error('connection reset')
+        view = memoryview(buffer)[:self.limit - self.tell()]
+        return io.BytesIO.readinto(self, view)
+
+
+def test_write_resumes_after_dropped_connection(client, tmpdir):
+    '''Verify a connection drop mid-body continues with a range request'''
+    dest = str(tmpdir.join('scene.tif'))
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, body=_DroppingStream(b'0123456789', 6),
+              headers={'content-length': '10'})
+        m.get(uri, text='6789', status_code=206,
+              request_headers={'Range': 'bytes=6-'},
+              headers={'content-range': 'bytes 6-9/10'})
+        body = client._get('scenes/ortho/x22/full').get_body()
+        body.write(dest)
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+    assert len(body) == 10
+
+
+@pytest.mark.skipif(sys.version_info < (3,),
+                    reason='python 2 responses have no readinto')
+def test_write_reports_progress_in_batches(client, tmpdir, monkeypatch):
+    '''Verify bodies read into buffers report progress in batches'''
+    monkeypatch.setattr(models, 'chunk_size', 2)
+    monkeypatch.setattr(models, 'progress_interval', 4)
+    dest = str(tmpdir.join('scene.tif'))
+    progress = []
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, text='0123456789')
+        body = client._get('scenes/ortho/x22/full').get_body()
+        body.write(dest, progress.append)
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+    assert progress == [4, 4, 2, body]
+
+    # bodies needing decoding are read with iter_content
+    progress = []
+    with requests_mock.Mocker() as m:
+        m.get(uri, text='0123456789', headers={'content-encoding': 'x'})
+        body = client._get('scenes/ortho/x22/full').get_body()
+        assert body._readinto(body.response) is None
+
+
+def test_write_checksums(client, tmpdir):
+    '''Verify bodies are digested as written, including resumed data'''
+    content = b'0123456789'
+    md5 = base64.b64encode(hashlib.md5(content).digest()).decode('ascii')
+    dest = str(tmpdir.join('scene.tif'))
+    tmpdir.join('scene.tif.part').write('0123')
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, content=content, headers={'content-length': '10'})
+        m.get(uri, content=content[4:], status_code=206,
+              request_headers={'Range': 'bytes=4-'},
+              headers={'content-range': 'bytes 4-9/10', 'content-md5': md5})
+        body = client._get('scenes/ortho/x22/full').get_body()
+        body.write(dest, checksums=['md5', 'sha256'])
+    assert body.checksums == {
+        'md5': hashlib.md5(content).hexdigest(),
+        'sha256': hashlib.sha256(content).hexdigest()
+    }
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+
+    # a body differing from the server's digest is not kept
+    dest = str(tmpdir.join('bad.tif'))
+    with requests_mock.Mocker() as m:
+        m.get(uri, content=b'01234x6789', headers={'content-md5': md5})
+        body = client._get('scenes/ortho/x22/full').get_body()
+        with pytest.raises(api.ChecksumMismatch):
+            body.write(dest, checksums=['md5'])
+    assert not tmpdir.join('bad.tif').exists()
+    assert not tmpdir.join('bad.tif.part').exists()
+
+
+def test_write_segments(client, tmpdir, monkeypatch):
+    '''Verify a segmented write fetches byte ranges into place'''
+    monkeypatch.setattr(models, 'segment_min_size', 1)
+    dest = str(tmpdir.join('scene.tif'))
+    content = '0123456789'
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, text=content,
+              headers={'content-length': '10', 'accept-ranges': 'bytes'})
+        for start, end in [(4, 7), (8, 9)]:
+            m.get(uri, text=content[start:end + 1], status_code=206,
+                  request_headers={'Range': 'bytes=%s-%s' % (start, end)},
+                  headers={'content-range': 'bytes %s-%s/10' % (start, end)})
+        client.fetch_scene_geotiffs(['x22'], segments=3)[0].get_body().write(
+            dest)
+        assert m.call_count == 3
+    assert tmpdir.join('scene.tif').read() == content
+
+
+def test_write_segments_without_range_support(client, tmpdir, monkeypatch):
+    '''Verify a segmented write falls back to one stream without ranges'''
+    monkeypatch.setattr(models, 'segment_min_size', 1)
+    dest = str(tmpdir.join('scene.tif'))
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, text='0123456789', headers={'content-length': '10'})
+        client.fetch_scene_geotiffs(['x22'], segments=3)[0].get_body().write(
+            dest)
+        assert m.call_count == 1
+    assert tmpdir.join('scene.tif').read() == '0123456789'
+
+
+def _mock_pages(m, client, count):
+    uri = os.path.join(client.base_url, 'scenes/ortho')
+    for i in range(count):
+        links = {}
+        if i < count - 1:
+            links['next'] = '%s?page=%s' % (uri, i + 1)
+        m.get('%s?page=%s' % (uri, i) if i else uri, complete_qs=bool(i),
+              json={'links': links, 'features': [{'id': 'x%s' % i}]})
+
+
+def test_scenes_iter(client):
+    '''Verify paging with and without prefetching'''
+    with requests_mock.Mocker() as m:
+        _mock_pages(m, client, 4)
+        for prefetch in (0, 1, 2):
+            scenes = client.get_scenes_list()
+            ids = [p.get()['features'][0]['id']
+                   for p in scenes.iter(prefetch=prefetch)]
+            assert ids == ['x0', 'x1', 'x2', 'x3']
+            scenes = client.get_scenes_list()
+            pages = list(scenes.iter(pages=2, prefetch=prefetch))
+            assert len(pages) == 2
+
+
+def test_scenes_iter_prefetch_error(client):
+    '''Verify a failure fetching a page is raised to the consumer'''
+    with requests_mock.Mocker() as m:
+        _mock_pages(m, client, 2)
+        uri = os.path.join(client.base_url, 'scenes/ortho')
+        m.get(uri + '?page=1', status_code=500, text='oops')
+        pages = client.get_scenes_list().iter()
+        next(pages)
+        with pytest.raises(api.exceptions.ServerError):
+            next(pages)
+
+
+def test_scenes_iter_features(client, monkeypatch):
+    '''Verify features are streamed across chunk boundaries'''
+    monkeypatch.setattr(models, 'chunk_size', 7)
+    fixture_path = os.path.join(FIXTURE_DIR, 'search.geojson')
+    with open(fixture_path) as src:
+        text = src.read()
+    expected = json.loads(text)
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho')
+        m.get(uri, text=text)
+        scenes = client.get_scenes_list()
+        features = list(scenes.iter_features())
+    assert features == expected['features']
+    assert scenes.meta['count'] == expected['count']
+    assert scenes.meta['links'] == expected['links']
+
+
+def test_scenes_iter_stream(client):
+    '''Verify streamed pages are not read ahead and need reading in full'''
+    with requests_mock.Mocker() as m:
+        _mock_pages(m, client, 3)
+        pages = client.get_scenes_list().iter(stream=True)
+        ids = [f['id'] for page in pages for f in page.iter_features()]
+        assert ids == ['x0', 'x1', 'x2']
+        assert m.call_count == 3
+        # the link to the next page follows the features
+        m.get(os.path.join(client.base_url, 'scenes/ortho'),
+              text='{"features": [{"id": "x0"}, {"id": "x1"}], "links": {}}')
+        scenes = client.get_scenes_list()
+        features = scenes.iter_features()
+        next(features)
+        with pytest.raises(ValueError):
+            scenes.next()
+
+
+def test_get_scenes_metadata(client):
+    '''Verify bulk metadata reports per scene results and failures'''
+    with requests_mock.Mocker() as m:
+        for sid in ('a', 'b', 'c'):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s' % sid)
+            m.get(uri, json={'id': sid})
+        uri = os.path.join(client.base_url, 'scenes/ortho/missing')
+        m.get(uri, status_code=404, text='no such scene')
+        ids = ['a', 'missing', 'b', 'c'] * 3
+        results = list(client.get_scenes_metadata(iter(ids), ordered=True))
+        assert [r[0] for r in results] == ids
+        for sid, body, error in results:
+            if sid == 'missing':
+                assert isinstance(error, api.exceptions.MissingResource)
+            else:
+                assert body.get() == {'id': sid}
+        results = list(client.get_scenes_metadata(ids))
+        assert sorted(r[0] for r in results) == sorted(ids)
+
+
+def test_retry_server_errors(client):
+    '''Verify transient failures are retried on sync and async paths'''
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, [{'status_code': 503, 'text': 'busy'},
+                    {'status_code': 429, 'text': 'slow down',
+                     'headers': {'Retry-After': '0'}},
+                    {'exc': requests.exceptions.ConnectionError},
+                    {'json': {'id': 'x22'}}] * 2)
+        assert client.get_scene_metadata('x22').get() == {'id': 'x22'}
+        bodies = []
+        response = client._get('scenes/ortho/x22', callback=bodies.append)
+        assert response.await().get() == {'id': 'x22'}
+        assert bodies
+        assert m.call_count == 8
+    assert client.dispatcher.retry.retried == 6
+
+
+def test_retry_limits(client):
+    '''Verify per request and global retry limits'''
+    client.dispatcher.retry.retries = 2
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, status_code=500, text='oops')
+        with pytest.raises(api.exceptions.ServerError):
+            client.get_scene_metadata('x22')
+        assert m.call_count == 3
+        client.dispatcher.retry.budget = 3
+        with pytest.raises(api.exceptions.ServerError):
+            client.get_scene_metadata('x22')
+        assert m.call_count == 5
+
+
+def test_retry_delay():
+    '''Verify backoff is jittered, bounded and honors Retry-After'''
+    policy = api.RetryPolicy(backoff=1, max_backoff=5)
+    for attempt in range(6):
+        assert 0 <= policy.delay(attempt) <= min(5, 2 ** attempt)
+    response = requests.Response()
+    response.headers['Retry-After'] = '3'
+    assert policy.delay(0, response) == 3
+    # an hour's Retry-After does not park a worker for an hour
+    response.headers['Retry-After'] = '3600'
+    assert policy.delay(0, response) == 5
+
+
+def test_concurrency_limit():
+    '''Verify additive increase and one multiplicative decrease per trip'''
+    limit = api.ConcurrencyLimit(floor=2, ceiling=8, start=4)
+    tokens = [limit.acquire() for _ in range(4)]
+    assert limit.in_flight == 4
+    for token in tokens:
+        limit.observe(token, 1, overloaded=True)
+        limit.release()
+    assert limit.concurrency == 2
+    for _ in range(100):
+        limit.observe(limit.acquire(), 1)
+        limit.release()
+    assert limit.concurrency == 8
+    limit.observe(limit.acquire(), 10)
+    limit.release()
+    assert limit.concurrency == 4
+
+
+def test_adaptive_dispatch():
+    '''Verify the dispatcher backs off on 429'''
+    limit = api.ConcurrencyLimit(floor=1, ceiling=8, start=8)
+    client = api.Client('foobar', limit=limit,
+                        retry=api.RetryPolicy(backoff=0))
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, [{'status_code': 429, 'text': 'slow down'},
+                    {'json': {}}])
+        client.get_scene_metadata('x22')
+    assert limit.concurrency == 4
+    assert limit.in_flight == 0
+
+
+def test_download_scene_geotiffs(client, tmpdir):
+    '''Verify bounded downloads report a record per scene'''
+    def scene_ids():
+        for sid in ('a', 'missing', 'b', 'c'):
+            yield sid
+    with requests_mock.Mocker() as m:
+        for sid in ('a', 'b', 'c'):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s/full' % sid)
+            m.get(uri, text='0123456789', headers={
+                'content-disposition': 'filename="%s.tif"' % sid
+            })
+        uri = os.path.join(client.base_url, 'scenes/ortho/missing/full')
+        m.get(uri, status_code=404, text='no such scene')
+        downloads = list(client.download_scene_geotiffs(
+            scene_ids(), str(tmpdir), max_in_flight=2, ordered=True))
+    assert [d.id for d in downloads] == ['a', 'missing', 'b', 'c']
+    assert [d.bytes for d in downloads] == [10, 0, 10, 10]
+    assert isinstance(downloads[1].error, api.exceptions.MissingResource)
+    assert downloads[0].path == str(tmpdir.join('a.tif'))
+    assert tmpdir.join('c.tif').read() == '0123456789'
+
+
+def test_download_skip_unchanged(client, tmpdir):
+    '''Verify files the server reports as unchanged are not fetched again'''
+    headers = {
+        'content-length': '10',
+        'last-modified': 'Thu, 01 Jan 2015 00:00:00 GMT'
+    }
+    tmpdir.join('a.tif').write('0123456789')
+    tmpdir.join('b.tif').write('old')
+    with requests_mock.Mocker() as m:
+        for sid in ('a', 'b'):
+            uri = os.path.join(client.base_url, 'scenes/ortho/%s/full' % sid)
+            headers['content-disposition'] = 'filename="%s.tif"' % sid
+            m.head(uri, headers=dict(headers))
+            m.get(uri, text='abcdefghij', headers=dict(headers))
+        downloads = list(client.download_scene_geotiffs(
+            ['a', 'b'], str(tmpdir), ordered=True, skip_unchanged=True))
+        methods = [r.method for r in m.request_history]
+    assert [d.bytes for d in downloads] == [0, 10]
+    assert downloads[0].path == str(tmpdir.join('a.tif'))
+    assert sorted(methods) == ['GET', 'HEAD', 'HEAD']
+    assert tmpdir.join('a.tif').read() == '0123456789'
+    assert tmpdir.join('b.tif').read() == 'abcdefghij'
+
+
+def test_write_skip_unchanged(client, tmpdir):
+    '''Verify the body is not read when the file is current'''
+    path = tmpdir.join('a.tif')
+    path.write('0123456789')
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'whatevs')
+        m.get(uri, text='abcdefghij', headers={
+            'content-length': '10',
+            'last-modified': 'Thu, 01 Jan 2015 00:00:00 GMT'
+        })
+        body = client._get('whatevs', models.Image).get_body()
+        body.write(str(path), skip_unchanged=True)
+        assert path.read() == '0123456789'
+        # a newer file on the server is fetched
+        m.get(uri, text='abcdefghij', headers={
+            'content-length': '10',
+            'last-modified': 'Fri, 01 Jan 2100 00:00:00 GMT'
+        })
+        body = client._get('whatevs', models.Image).get_body()
+        body.write(str(path), skip_unchanged=True)
+        assert path.read() == 'abcdefghij'
+
+
+def test_hooks(tmpdir):
+    '''Verify events for each attempt and each body written'''
+    events = []
+    client = api.Client('foobar', retry=api.RetryPolicy(backoff=0),
+                        hooks=[events.append])
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/a/full')
+        m.get(uri, [{'status_code': 503, 'text': 'busy'},
+                    {'text': '0123456789', 'headers': {
+                        'content-disposition': 'filename="a.tif"'}}])
+        list(client.download_scene_geotiffs(['a'], str(tmpdir)))
+    assert [e['event'] for e in events] == ['request', 'request', 'body']
+    assert [e['status'] for e in events[:2]] == [503, 200]
+    assert [e['attempt'] for e in events[:2]] == [0, 1]
+    assert events[0]['in_flight'] == 1
+    assert events[0]['queue_wait'] >= 0
+    assert events[2]['bytes'] == 10
+    assert events[2]['duration'] >= 0
+
+    # bodies read into memory too, once each
+    del events[:]
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/a')
+        m.get(uri, json={'id': 'a'})
+        body = client.get_scene_metadata('a')
+        body.get()
+        body.get_raw()
+        list(client.get_scenes_metadata(['a']))
+    bodies = [e for e in events if e['event'] == 'body']
+    assert [e['bytes'] for e in bodies] == [11, 11]
+
+
+def test_connection_pool():
+    '''Verify the pool keeps a connection per worker and can be shared'''
+    client = api.Client('foobar', workers=12)
+    for url in ('http://example.com', 'https://example.com'):
+        adapter = client.dispatcher.session.get_adapter(url)
+        assert adapter._pool_maxsize == 12
+    other = api.Client('barfoo', dispatcher=client.dispatcher)
+    assert other.dispatcher is client.dispatcher
+
+
+def test_warm(client):
+    with requests_mock.Mocker() as m:
+        m.head(client.base_url, status_code=401)
+        assert client.warm() == 4
+        assert client.warm(2) == 2
+        assert m.call_count == 6
+
+
+def test_key_pool():
+    '''Verify requests are spread over keys, resting those over quota'''
+    client = api.Client(['a', 'b'], retry=api.RetryPolicy(backoff=0))
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'whatevs')
+        m.get(uri, text='{}')
+        m.get(uri, status_code=429, headers={'retry-after': '60'},
+              request_headers={'Authorization': 'api-key b'})
+        for _ in range(4):
+            client._get('whatevs').get_body()
+        keys = [r.headers['Authorization'] for r in m.request_history]
+    # b is refused once and then rests
+    assert keys == ['api-key a', 'api-key b', 'api-key a', 'api-key a',
+                    'api-key a']
+    stats = client.auth.stats()
+    assert [s['requests'] for s in stats] == [4, 1]
+    assert [s['throttled'] for s in stats] == [0, 1]
+    assert [s['in_flight'] for s in stats] == [0, 0]
+
+
+def test_key_pool_least_loaded():
+    pool = api.auth.KeyPool(['a', 'b', 'c'], 'least-loaded')
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert pool.acquire().value == 'c'
+    assert second.value == 'b'
+
+
+def _concurrently(func, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(func()))
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _slowly(content):
+    def respond(request, context):
+        time.sleep(.2)
+        return content
+    return respond
+
+
+def test_coalesce(tmpdir):
+    '''Verify identical requests in flight at once share one request'''
+    metrics = api.Metrics()
+    client = api.Client('foobar', hooks=[metrics])
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, text=_slowly('{"id": "x22"}'))
+        bodies = _concurrently(
+            lambda: client.get_scene_metadata('x22').get(), 4)
+        assert m.call_count == 1
+    assert bodies == [{'id': 'x22'}] * 4
+    # parsed once for all of them
+    assert all(body is bodies[0] for body in bodies)
+    assert metrics.stats()['coalesced'] == 3
+
+    # images only if asked for, each writer getting the whole body
+    for coalesce, calls in ((None, 3), ('all', 1)):
+        client = api.Client('foobar', coalesce=coalesce)
+        with requests_mock.Mocker() as m:
+            uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+            m.get(uri, content=_slowly(b'0123456789'))
+
+            def fetch():
+                out = io.BytesIO()
+                client.fetch_scene_geotiffs(['x22'])[0].get_body().write(out)
+                return out.getvalue()
+            assert _concurrently(fetch, 3) == [b'0123456789'] * 3
+            assert m.call_count == calls
+
+
+def test_coalesce_cancelled():
+    '''Verify a leading request cancelled before it was sent doesn't
+    leave identical requests waiting'''
+    client = api.Client('foobar', workers=1)
+    dispatcher = client.dispatcher
+    with requests_mock.Mocker() as m:
+        busy = os.path.join(client.base_url, 'scenes/ortho/busy')
+        m.get(busy, text=_slowly('{}'))
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22')
+        m.get(uri, json={'id': 'x22'})
+        request = client._request('scenes/ortho/x22')
+
+        # cancelled alone, the flight ends
+        dispatcher._dispatch_async(client._request('scenes/ortho/busy'), None)
+        leader = dispatcher._dispatch_async(request, None)
+        assert leader.cancel()
+        assert not [k for k in dispatcher._flights if 'x22' in k]
+        response = dispatcher._dispatch_async(request, None).result(5)
+        assert response.json() == {'id': 'x22'}
+
+        # cancelled with a follower, the request is sent for it
+        dispatcher._dispatch_async(client._request('scenes/ortho/busy'), None)
+        leader = dispatcher._dispatch_async(request, None)
+        follower = dispatcher._dispatch_async(request, None)
+        assert leader.cancel()
+        assert follower.result(5).json() == {'id': 'x22'}
+        assert not [k for k in dispatcher._flights if 'x22' in k]
@@ -0,0 +1,108 @@
+# Copyright 2015 Planet Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import time
+
+from planet import api
+from planet.api import models
+from planet.api.writer import WriterPool
+from planet.api.writer import _PooledFile
+import pytest
+import requests_mock
+
+
+class _SlowFile(io.BytesIO):
+
+    def write(self, data):
+        time.sleep(.01)
+        return io.BytesIO.write(self, data)
+
+    def close(self):
+        self.closed_value = self.getvalue()
+        io.BytesIO.close(self)
+
+
+def test_writer_pool(tmpdir):
+    pool = WriterPool(writers=2)
+    paths = [str(tmpdir.join(name)) for name in 'ab']
+    files = [pool.open(path) for path in paths]
+    chunks = [('%02d' % i).encode('ascii') for i in range(100)]
+    for chunk in chunks:
+        for f in files:
+            f.write(chunk)
+    for f in files:
+        f.close()
+    expected = b''.join(chunks)
+    for path in paths:
+        with open(path, 'rb') as fp:
+            assert fp.read() == expected
+    assert pool.stats()['bytes'] == 400
+    pool.close()
+
+
+def test_writer_pool_bounded():
+    pool = WriterPool(writers=1, buffer_size=8)
+    slow = _SlowFile()
+    f = _PooledFile(pool, slow, pool._queues[0])
+    for _ in range(10):
+        f.write(b'0123')
+    f.close()
+    assert slow.closed_value == b'0123' * 10
+    stats = pool.stats()
+    # the disk is the slow side, so reads waited for space
+    assert stats['max_queued'] <= 8
+    assert stats['read_blocked'] > .05
+    pool.close()
+
+
+def test_writer_pool_error():
+    class Full(io.BytesIO):
+        def write(self, data):
+            raise IOError('disk full')
+    pool = WriterPool(writers=1)
+    f = _PooledFile(pool, Full(), pool._queues[0])
+    f.write(b'0123')
+    with pytest.raises(IOError):
+        f.close()
+    pool.close()
+
+
+def test_write_with_writer_pool(tmpdir, monkeypatch):
+    '''Verify resumed and segmented writes go through the pool in order'''
+    monkeypatch.setattr(models, 'segment_min_size', 1)
+    pool = WriterPool(writers=2, buffer_size=4, chunk_size=2)
+    client = api.Client('foobar', writer=pool)
+    content = '0123456789'
+    tmpdir.join('resumed.tif.part').write('0123')
+    with requests_mock.Mocker() as m:
+        uri = os.path.join(client.base_url, 'scenes/ortho/x22/full')
+        m.get(uri, text=content,
+              headers={'content-length': '10', 'accept-ranges': 'bytes'})
+        for start, end in [(4, 7), (8, 9)]:
+            m.get(uri, text=content[start:end + 1], status_code=206,
+                  request_headers={'Range': 'bytes=%s-%s' % (start, end)},
+                  headers={'content-range': 'bytes %s-%s/10' % (start, end)})
+        m.get(uri, text=content[4:], status_code=206,
+              request_headers={'Range': 'bytes=4-'},
+              headers={'content-range': 'bytes 4-9/10'})
+        body = client.fetch_scene_geotiffs(['x22'], segments=3)[0]
+        body.get_body().write(str(tmpdir.join('segmented.tif')))
+        body = client._get('scenes/ortho/x22/full').get_body()
+        body.write(str(tmpdir.join('resumed.tif')))
+    assert tmpdir.join('segmented.tif').read() == content
+    assert tmpdir.join('resumed.tif').read() == content
+    assert pool.stats()['bytes'] == 16
+    pool.close()